@@ -1,8 +1,10 @@
 import time
 from datetime import datetime, timedelta
-from flask import Flask, jsonify, request
+import orjson
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, raiseload, selectinload
 import re
 
 # Load environment variables (for OPENAI_KEY in .env)
@@ -24,25 +26,56 @@ except Exception as e:
 
 # Import our MosaicML AI assistant
 try:
-    from .mosaic_nutrition_ai import mosaic_nutrition_ai
+    from .mosaic_nutrition_ai import clear_nutrition_caches, get_mosaic_nutrition_ai, get_openai_client
 except ImportError:
-    from mosaic_nutrition_ai import mosaic_nutrition_ai
+    from mosaic_nutrition_ai import clear_nutrition_caches, get_mosaic_nutrition_ai, get_openai_client
 
 # Robust imports to work both as a module and as a script
 try:
     from .db import init_db, SessionLocal
-    from .models import FoodItem, NutritionFacts, CustomFood, UserGrocery
-    from .usda_db import USDA_ENGINE
-    from .usda_queries import search_usda, lookup_upc, get_basic_nutrients, get_food_basic
+    from .models import FoodItem, NutritionFacts, CustomFood, UserGrocery, utcnow
+    from .usda_db import get_usda_engine, usda_available
+    from .usda_queries import get_food_with_nutrients
+    from .usda_queries import cache_clear as usda_cache_clear, get_basic_nutrients_bulk
+    from .usda_queries import lookup_upc_cached, search_usda_cached
+    from .grocery_endpoints import invalidate_user_groceries
 except ImportError:  # Running as a script
     import os, sys
     sys.path.append(os.path.dirname(__file__))
     from db import init_db, SessionLocal
-    from models import FoodItem, NutritionFacts, CustomFood, UserGrocery
-    from usda_db import USDA_ENGINE
-    from usda_queries import search_usda, lookup_upc, get_basic_nutrients, get_food_basic
+    from models import FoodItem, NutritionFacts, CustomFood, UserGrocery, utcnow
+    from usda_db import get_usda_engine, usda_available
+    from usda_queries import get_food_with_nutrients
+    from usda_queries import cache_clear as usda_cache_clear, get_basic_nutrients_bulk
+    from usda_queries import lookup_upc_cached, search_usda_cached
+    from grocery_endpoints import invalidate_user_groceries
+
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify and request.get_json through orjson.
+
+    Keys stay sorted as with Flask's default provider; dates and datetimes come out as ISO 8601,
+    the same as the routes that already build orjson Responses directly. Other types orjson
+    doesn't know (Decimal, UUID, ...) go through Flask's default conversion.
+    """
+    OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.OPTIONS), mimetype=self.mimetype
+        )
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 # Configure CORS for React frontend
 # Get allowed origins from environment or use defaults
 allowed_origins = os.getenv('CORS_ORIGINS', 'http://localhost:5173,http://127.0.0.1:5173').split(',')
@@ -60,6 +93,55 @@ CORS(app, origins=allowed_origins,
 # Initialize database and tables on startup
 init_db()
 
+# Development only (FLASK_DEBUG=1): fail fast on accidental N+1 lazy loads.
+# nplusone is an optional dev dependency (pip install nplusone).
+if app.debug:
+    try:
+        from nplusone.ext.flask_sqlalchemy import NPlusOne
+    except ImportError:
+        print("⚠️  nplusone not installed; N+1 query detection disabled")
+    else:
+        import logging
+        app.config['NPLUSONE_RAISE'] = True
+        app.config['NPLUSONE_LOGGER'] = logging.getLogger('nplusone')
+        app.config['NPLUSONE_LOG_LEVEL'] = logging.ERROR
+        NPlusOne(app)
+
+
+@app.teardown_appcontext
+def remove_db_session(exc=None):
+    """Return the request's scoped session connection to the pool, even on errors."""
+    SessionLocal.remove()
+
+
+# Upper bound on a search's ?limit=: results are kept in the USDA search cache keyed by limit, so
+# an unbounded value could pin a huge result in every cache slot
+USDA_SEARCH_MAX_LIMIT = 100
+
+
+def usda_conn():
+    """This request's USDA connection: checked out on first use, so every USDA lookup in the
+    request shares it and routes that never touch USDA never check one out."""
+    if 'usda_conn' not in g:
+        g.usda_conn = get_usda_engine().connect()
+    return g.usda_conn
+
+
+@app.teardown_appcontext
+def close_usda_conn(exc=None):
+    conn = g.pop('usda_conn', None)
+    if conn is not None:
+        conn.close()
+
+
+def food_name_matches(query: str):
+    """Filter expression for a FoodItem name search: case-insensitive substring match.
+
+    On PostgreSQL the leading-wildcard ILIKE is served by the ix_food_items_name_trgm
+    trigram GIN index (see db._POSTGRES_INDEXES) instead of a sequential scan.
+    """
+    return FoodItem.name.ilike(f'%{query}%')
+
 
 def get_smart_expiration_days(food_name: str, category: str = None, data_type: str = None) -> int:
     """Calculate smart expiration days based on food type and name."""
@@ -164,8 +246,6 @@ def get_current_time():
 def test_ai():
     """Simple AI test endpoint"""
     try:
-        from openai import OpenAI
-        
         api_key = os.getenv("OPENAI_KEY")
         if not api_key:
             return jsonify({
@@ -174,7 +254,8 @@ def test_ai():
                 'error_type': 'MissingCredentials'
             }), 500
         
-        client = OpenAI(api_key=api_key, timeout=10.0)
+        # Shared client (and connection pool) with a shorter timeout for this check
+        client = get_openai_client().with_options(timeout=10.0)
         
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -201,7 +282,7 @@ def list_foods():
     """List a few food items for smoke testing."""
     session = SessionLocal()
     try:
-        q = session.query(FoodItem).limit(25).all()
+        q = session.query(FoodItem).options(selectinload(FoodItem.nutrition)).limit(25).all()
         data = []
         for f in q:
             facts = None
@@ -228,59 +309,58 @@ def list_foods():
 
 @app.get('/api/usda/search')
 def api_usda_search():
-    if USDA_ENGINE is None:
+    if not usda_available():
         return jsonify({'error': 'USDA DB not found. Place USDA.sqlite under data/vendor/USDADataBase.'}), 503
     q = (request.args.get('q') or '').strip()
-    limit = int(request.args.get('limit', '20'))
+    limit = max(1, min(request.args.get('limit', 20, type=int), USDA_SEARCH_MAX_LIMIT))
     if not q:
         return jsonify([])
-    results = search_usda(USDA_ENGINE, q, limit)
+    results = search_usda_cached(q, limit)
     return jsonify(results)
 
 
 @app.get('/api/usda/search-with-nutrition')
 def api_usda_search_with_nutrition():
     """Enhanced search that includes nutritional data and filters duplicates"""
-    if USDA_ENGINE is None:
+    if not usda_available():
         return jsonify({'error': 'USDA DB not found. Place USDA.sqlite under data/vendor/USDADataBase.'}), 503
     
     q = (request.args.get('q') or '').strip()
-    limit = int(request.args.get('limit', '20'))
+    limit = max(1, min(request.args.get('limit', 20, type=int), USDA_SEARCH_MAX_LIMIT))
     
     if not q:
         return jsonify([])
     
     # Get search results with a higher limit to account for filtering
-    raw_results = search_usda(USDA_ENGINE, q, limit * 3)  # Get more results to filter
+    raw_results = search_usda_cached(q, limit * 3)  # Get more results to filter
     
-    # Filter and enhance results
-    enhanced_results = []
+    # Keep the first (best ranked) result per description, up to limit
+    kept = []
     seen_descriptions = set()  # Track descriptions to avoid duplicates
-    
     for result in raw_results:
         description = result.get('description', '')
-        fdc_id = result.get('fdc_id')
-        
-        # Skip duplicates by description
         if description in seen_descriptions:
             continue
-            
-        # Prioritize branded_food over sub_sample_food
-        data_type = result.get('data_type', '')
-        if data_type == 'sub_sample_food':
-            # Check if we already have a branded version of this
-            if any(r['description'] == description and r.get('data_type') == 'branded_food' 
-                   for r in enhanced_results):
-                continue
-        
-        # Get nutritional data for this food item
-        nutrition = get_basic_nutrients(USDA_ENGINE, fdc_id) if fdc_id else {}
+        seen_descriptions.add(description)
+        kept.append(result)
+        if len(kept) >= limit:
+            break
+    
+    # Nutritional data for all kept results in one IN (...) query
+    nutrition_map = get_basic_nutrients_bulk(
+        usda_conn(), [result['fdc_id'] for result in kept if result.get('fdc_id')]
+    )
+    
+    enhanced_results = []
+    for result in kept:
+        fdc_id = result.get('fdc_id')
+        nutrition = nutrition_map.get(fdc_id, {})
         
         # Structure the enhanced result
-        enhanced_result = {
+        enhanced_results.append({
             'fdc_id': fdc_id,
-            'description': description,
-            'data_type': data_type,
+            'description': result.get('description', ''),
+            'data_type': result.get('data_type', ''),
             'brand': result.get('brand'),
             'brand_name': result.get('brand_name'),
             'brand_owner': result.get('brand_owner'),
@@ -295,14 +375,7 @@ def api_usda_search_with_nutrition():
                 'fiber_g': nutrition.get('fiber_g'),
                 'sugar_g': nutrition.get('sugar_g')
             }
-        }
-        
-        enhanced_results.append(enhanced_result)
-        seen_descriptions.add(description)
-        
-        # Stop once we have enough unique results
-        if len(enhanced_results) >= limit:
-            break
+        })
     
     return jsonify(enhanced_results)
 
@@ -311,7 +384,7 @@ def api_usda_search_with_nutrition():
 def api_unified_search():
     """Unified search endpoint for dashboard compatibility - searches both USDA and local foods"""
     query = (request.args.get('query') or '').strip()
-    limit = int(request.args.get('limit', '20'))
+    limit = max(1, min(request.args.get('limit', 20, type=int), USDA_SEARCH_MAX_LIMIT))
     favorites_only = request.args.get('favorites_only', '').lower() == 'true'
     user_id = request.args.get('user_id', 'demo_user')
     
@@ -327,7 +400,7 @@ def api_unified_search():
             favs = (
                 session.query(UserFavorite)
                 .filter(UserFavorite.user_id == user_id)
-                .options(joinedload(UserFavorite.food_item), joinedload(UserFavorite.custom_food))
+                .options(selectinload(UserFavorite.food_item), selectinload(UserFavorite.custom_food), raiseload('*'))
                 .order_by(UserFavorite.created_at.desc())
                 .all()
             )
@@ -385,9 +458,9 @@ def api_unified_search():
                     user_favorites[f"custom_{fav.custom_food_id}"] = fav.id
             
             # Search USDA database first
-            if USDA_ENGINE is not None:
+            if usda_available():
                 try:
-                    usda_results = search_usda(USDA_ENGINE, query, limit)
+                    usda_results = search_usda_cached(query, limit)
                     for result in usda_results:
                         # Transform USDA results to match dashboard expectations
                         item_id = f"usda_{result.get('fdc_id')}"
@@ -407,7 +480,7 @@ def api_unified_search():
             
             # Search local food items
             local_foods = session.query(FoodItem).filter(
-                FoodItem.name.ilike(f'%{query}%')
+                food_name_matches(query)
             ).limit(limit - len(results)).all()
             
             for food in local_foods:
@@ -444,8 +517,10 @@ def api_get_fridge_items():
             UserGrocery.user_id == user_id,
             UserGrocery.is_expired == False
         ).options(
-            joinedload(UserGrocery.food_item).joinedload(FoodItem.nutrition),
-            joinedload(UserGrocery.custom_food)
+            # One extra SELECT per relationship regardless of row count; anything else raises
+            selectinload(UserGrocery.food_item),
+            selectinload(UserGrocery.custom_food),
+            raiseload('*')
         ).order_by(UserGrocery.created_at.desc()).all()
         
         result = []
@@ -479,13 +554,14 @@ def api_get_fridge_items():
                 'type': item_type,  # Add type field to distinguish USDA vs custom
                 'quantity': grocery.quantity,
                 'unit': grocery.unit,
-                'expiry_date': grocery.expiration_date.isoformat() if grocery.expiration_date else None,
-                'created_at': grocery.created_at.isoformat(),
-                'updated_at': grocery.updated_at.isoformat()
+                # date/datetime values are encoded as ISO 8601 by orjson
+                'expiry_date': grocery.expiration_date,
+                'created_at': grocery.created_at,
+                'updated_at': grocery.updated_at
             }
             result.append(item)
         
-        return jsonify(result)
+        return Response(orjson.dumps(result), mimetype='application/json')
         
     finally:
         session.close()
@@ -525,12 +601,11 @@ def api_add_fridge_item():
             try:
                 fdc_id = int(fdc_id_str)
                 # Try to import from USDA first
-                from usda_queries import get_food_basic, get_basic_nutrients
-                if USDA_ENGINE:
-                    basic = get_food_basic(USDA_ENGINE, fdc_id)
-                    facts = get_basic_nutrients(USDA_ENGINE, fdc_id)
+                if usda_available():
+                    basic = get_food_with_nutrients(usda_conn(), fdc_id)
                     
                     if basic:
+                        facts = basic['nutrients']
                         # Create local FoodItem
                         food_name = basic.get('description')
                         brand = basic.get('brand_name') or basic.get('brand_owner')
@@ -549,6 +624,7 @@ def api_add_fridge_item():
                                 brand=brand,
                                 category=category,
                                 upc=upc,
+                                fdc_id=fdc_id,
                                 is_perishable=True
                             )
                             session.add(existing_food)
@@ -610,6 +686,7 @@ def api_add_fridge_item():
         
         session.add(grocery)
         session.commit()
+        invalidate_user_groceries(user_id)
         
         return jsonify({
             'id': grocery.id,
@@ -654,8 +731,9 @@ def api_update_fridge_item(item_id: int):
                 # Update purchase date instead of created_at
                 grocery.purchase_date = datetime.fromisoformat(data['created_at']).date()
         
-        grocery.updated_at = datetime.utcnow()
+        grocery.updated_at = utcnow()  # database clock, also when no other field changed
         session.commit()
+        invalidate_user_groceries(user_id)
         
         return jsonify({
             'id': grocery.id,
@@ -686,6 +764,7 @@ def api_delete_fridge_item(item_id: int):
         
         session.delete(grocery)
         session.commit()
+        invalidate_user_groceries(user_id)
         
         return jsonify({'message': 'Item removed from fridge'})
         
@@ -698,22 +777,39 @@ def api_delete_fridge_item(item_id: int):
 
 @app.get('/api/usda/upc/<upc>')
 def api_usda_upc(upc: str):
-    if USDA_ENGINE is None:
+    if not usda_available():
         return jsonify({'error': 'USDA DB not found. Place USDA.sqlite under data/vendor/USDADataBase.'}), 503
-    row = lookup_upc(USDA_ENGINE, upc)
+    row = lookup_upc_cached(upc)
     return jsonify(row or {})
 
 
+@app.post('/api/usda/cache/clear')
+def api_usda_cache_clear():
+    """Drop the USDA lookup caches and engine, e.g. after replacing USDA.sqlite.
+
+    Only clears the worker process that handles the request; with several gunicorn workers,
+    restart the service to reset all of them.
+    """
+    usda_cache_clear()
+    clear_nutrition_caches()
+    # Close the pooled connections to the old file; the next request reopens USDA.sqlite.
+    # Skipped when no engine was built (e.g. the DB is missing) so this never raises
+    if get_usda_engine.cache_info().currsize:
+        get_usda_engine().dispose()
+        get_usda_engine.cache_clear()
+    return jsonify({'message': 'USDA caches cleared'})
+
+
 @app.post('/api/usda/import/<int:fdc_id>')
 def api_usda_import(fdc_id: int):
-    if USDA_ENGINE is None:
+    if not usda_available():
         return jsonify({'error': 'USDA DB not found. Place USDA.sqlite under data/vendor/USDADataBase.'}), 503
 
-    basic = get_food_basic(USDA_ENGINE, fdc_id)
+    basic = get_food_with_nutrients(usda_conn(), fdc_id)
     if not basic:
         return jsonify({'error': f'fdc_id {fdc_id} not found'}), 404
 
-    facts = get_basic_nutrients(USDA_ENGINE, fdc_id)
+    facts = basic['nutrients']
 
     session = SessionLocal()
     try:
@@ -724,26 +820,31 @@ def api_usda_import(fdc_id: int):
 
         existing = (
             session.query(FoodItem)
+            .options(joinedload(FoodItem.nutrition))
             .filter(FoodItem.name == name)
             .filter(FoodItem.brand == brand)
             .filter(FoodItem.upc == upc)
             .first()
         )
         item = existing
+        if existing and existing.fdc_id is None:
+            # Imported before food_items had fdc_id: link it so fdc_id lookups find it
+            existing.fdc_id = fdc_id
         if not item:
             item = FoodItem(
                 name=name,
                 brand=brand,
                 category=None,
                 upc=upc,
+                fdc_id=fdc_id,
                 is_perishable=True,
             )
             session.add(item)
             session.flush()
 
-        # Upsert nutrition facts
-        if item.nutrition:
-            session.delete(item.nutrition)
+        # Upsert nutrition facts (a just-created item has none)
+        if existing and existing.nutrition:
+            session.delete(existing.nutrition)
             session.flush()
 
         nf = NutritionFacts(
@@ -785,14 +886,16 @@ def ai_chat():
         
         print("🤖 [AI Chat] Calling MosaicML AI service...")
         # Generate AI response using MosaicML
-        ai_response = mosaic_nutrition_ai.generate_nutrition_advice(user_message)
+        ai_response = get_mosaic_nutrition_ai().generate_nutrition_advice(
+            user_message, force_refresh=bool(data.get('force_refresh'))
+        )
         
         print(f"✅ [AI Chat] Response generated: {len(ai_response)} characters")
         
         # Try to extract macros JSON from the AI response
         macros = None
         try:
-            macros = mosaic_nutrition_ai.extract_macros_json(ai_response)
+            macros = get_mosaic_nutrition_ai().extract_macros_json(ai_response)
         except Exception:
             macros = None
         
@@ -820,10 +923,53 @@ def ai_chat():
         }), 500
 
 
+def _sse_answer(chunks):
+    """Server-Sent Events for a streamed model answer.
+
+    Each `data:` event is a JSON object {"delta": "<text>"}; a final `event: done` carries
+    {"macros": ...} parsed from the full answer, or `event: error` {"error": ...} if the model
+    call fails part way.
+    """
+    def events():
+        parts = []
+        try:
+            for delta in chunks:
+                parts.append(delta)
+                yield b'data: ' + orjson.dumps({'delta': delta}) + b'\n\n'
+        except Exception as e:
+            print(f"❌ [AI Stream] Error occurred: {str(e)}")
+            yield b'event: error\ndata: ' + orjson.dumps({'error': str(e)}) + b'\n\n'
+            return
+        try:
+            macros = get_mosaic_nutrition_ai().extract_macros_json(''.join(parts))
+        except Exception:
+            macros = None
+        yield b'event: done\ndata: ' + orjson.dumps({'macros': macros}) + b'\n\n'
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/api/ai/chat/stream', methods=['POST'])
+def ai_chat_stream():
+    """Streaming variant of /api/ai/chat (see _sse_answer for the event format)"""
+    data = request.get_json(silent=True)
+    user_message = data.get('message', '').strip() if data else ''
+    if not user_message:
+        return jsonify({'error': 'Message is required'}), 400
+
+    return _sse_answer(get_mosaic_nutrition_ai().stream_nutrition_advice(
+        user_message, force_refresh=bool(data.get('force_refresh'))
+    ))
+
+
 @app.route('/api/ai/status', methods=['GET'])
 def ai_status():
     """Check if MosaicML AI is ready"""
-    ai_ready = mosaic_nutrition_ai.is_ready()
+    ai_ready = get_mosaic_nutrition_ai().is_ready()
     return jsonify({
         'ai_ready': ai_ready,
         'service': 'MosaicML',
@@ -852,14 +998,16 @@ def ai_recipe_suggestions():
         
         print("🤖 [Recipe Suggestions] Calling inventory-aware AI...")
         # Generate recipe suggestions based on user's groceries
-        ai_response = mosaic_nutrition_ai.suggest_recipes_with_inventory(user_message, user_id)
+        ai_response = get_mosaic_nutrition_ai().suggest_recipes_with_inventory(
+            user_message, user_id, force_refresh=bool(data.get('force_refresh'))
+        )
         
         print(f"✅ [Recipe Suggestions] Suggestions generated: {len(ai_response)} characters")
         
         # Try to extract macros JSON from the AI response
         macros = None
         try:
-            macros = mosaic_nutrition_ai.extract_macros_json(ai_response)
+            macros = get_mosaic_nutrition_ai().extract_macros_json(ai_response)
         except Exception:
             macros = None
         
@@ -889,6 +1037,22 @@ def ai_recipe_suggestions():
         }), 500
 
 
+@app.route('/api/ai/recipe-suggestions/stream', methods=['POST'])
+def ai_recipe_suggestions_stream():
+    """Streaming variant of /api/ai/recipe-suggestions (see _sse_answer for the event format)"""
+    data = request.get_json(silent=True) or {}
+    user_message = data.get('message', 'What can I cook with my available groceries?').strip()
+    user_id = data.get('user_id', 'demo_user')
+    if not user_message:
+        return jsonify({'error': 'Message is required'}), 400
+    if not get_mosaic_nutrition_ai().is_ready():
+        return jsonify({'error': 'Recipe suggestion service error: MosaicML client not ready'}), 503
+
+    return _sse_answer(get_mosaic_nutrition_ai().stream_recipes_with_inventory(
+        user_message, user_id, force_refresh=bool(data.get('force_refresh'))
+    ))
+
+
 # Recipe Generation Endpoints
 @app.route('/api/recipes/generate', methods=['POST'])
 def generate_recipe():
@@ -8,6 +8,8 @@ import sqlite3
 import pandas as pd
 from pathlib import Path
 
+from build_usda_sqlite import create_search_index
+
 def build_simple_usda():
     """Build a simple USDA SQLite database with basic food data"""
     csv_dir = Path("../data/vendor/FoodData_Central_csv_2024-04-18")
@@ -110,6 +112,10 @@ def build_simple_usda():
         
         print(f"Imported {branded_count} branded food items")
         
+        # Substring search index used by usda_queries
+        print("Building search index...")
+        create_search_index(conn)
+        
         # Optimize database
         print("Optimizing database...")
         cursor.execute("VACUUM")
@@ -7,6 +7,8 @@ from typing import Iterable, Optional
 
 import pandas as pd
 
+from usda_queries import NUTRIENT_KEYS
+
 
 REQUIRED_FILES = {
     "food": "food.csv",
@@ -122,7 +124,10 @@ def create_indexes(conn: sqlite3.Connection):
         CREATE INDEX IF NOT EXISTS idx_food_desc ON food(description);
         CREATE INDEX IF NOT EXISTS idx_bf_upc ON branded_food(gtin_upc);
         CREATE INDEX IF NOT EXISTS idx_bf_brand ON branded_food(brand_name, brand_owner);
-        CREATE INDEX IF NOT EXISTS idx_fn_fdc ON food_nutrient(fdc_id);
+        -- Covering index for the per-food nutrient lookup (fdc_id, nutrient_id IN ...): amount is
+        -- read from the index, never the table. Replaces the plain idx_fn_fdc, its prefix.
+        DROP INDEX IF EXISTS idx_fn_fdc;
+        CREATE INDEX IF NOT EXISTS idx_fn_cover ON food_nutrient(fdc_id, nutrient_id, amount);
         CREATE INDEX IF NOT EXISTS idx_fn_nutrient ON food_nutrient(nutrient_id);
         CREATE INDEX IF NOT EXISTS idx_nutrient_code ON nutrient(nutrient_id);
         """
@@ -130,6 +135,60 @@ def create_indexes(conn: sqlite3.Connection):
     conn.commit()
 
 
+def create_search_index(conn: sqlite3.Connection):
+    """Trigram FTS5 index over the searchable text, keyed by fdc_id (rowid).
+
+    usda_queries answers its substring searches (LIKE '%q%' on description / brand) from this
+    index instead of scanning every food row. The trigram tokenizer matches any substring of
+    3+ characters, case-insensitively, so results are the same as the LIKE scan.
+    """
+    cur = conn.cursor()
+    cur.executescript(
+        """
+        DROP TABLE IF EXISTS food_fts;
+        CREATE VIRTUAL TABLE food_fts USING fts5(
+            description, brand_name, brand_owner, tokenize = 'trigram'
+        );
+        INSERT INTO food_fts (rowid, description, brand_name, brand_owner)
+        SELECT f.fdc_id, f.description, b.brand_name, b.brand_owner
+        FROM food f
+        LEFT JOIN branded_food b ON b.fdc_id = f.fdc_id;
+        INSERT INTO food_fts (food_fts) VALUES ('optimize');
+        """
+    )
+    conn.commit()
+
+
+def create_macros_table(conn: sqlite3.Connection):
+    """food_macros: one row per food with the basic nutrients usda_queries serves as columns
+    (calories, protein_g, ...), so a lookup is a primary-key fetch instead of a food_nutrient scan.
+    """
+    columns = ", ".join(f"{key} REAL" for key in NUTRIENT_KEYS.values())
+    pivots = ",\n               ".join(
+        f"MAX(CASE WHEN fn.nutrient_id = {nutrient_id} THEN fn.amount END)"
+        for nutrient_id in NUTRIENT_KEYS
+    )
+    ids = ", ".join(str(nutrient_id) for nutrient_id in NUTRIENT_KEYS)
+    cur = conn.cursor()
+    cur.executescript(
+        f"""
+        DROP TABLE IF EXISTS food_macros;
+        CREATE TABLE food_macros (
+            fdc_id INTEGER PRIMARY KEY,
+            {columns}
+        );
+        INSERT INTO food_macros
+        SELECT fn.fdc_id,
+               {pivots}
+        FROM food_nutrient fn
+        JOIN nutrient n ON n.id = fn.nutrient_id
+        WHERE fn.nutrient_id IN ({ids})
+        GROUP BY fn.fdc_id;
+        """
+    )
+    conn.commit()
+
+
 def build(csv_dir: Path, out_db: Path, overwrite: bool = False):
     csv_dir = csv_dir.resolve()
     out_db = out_db.resolve()
@@ -194,6 +253,12 @@ def build(csv_dir: Path, out_db: Path, overwrite: bool = False):
         create_indexes(conn)
         print("Indexes created.")
 
+        create_search_index(conn)
+        print("Search index created.")
+
+        create_macros_table(conn)
+        print("food_macros table created.")
+
         # Optimize DB size
         conn.execute("VACUUM")
         conn.commit()
@@ -204,11 +269,24 @@ def build(csv_dir: Path, out_db: Path, overwrite: bool = False):
 
 def main():
     parser = argparse.ArgumentParser(description="Build USDA SQLite from FoodData Central CSVs (subset)")
-    parser.add_argument("--csv-dir", required=True, help="Path to USDA CSV folder (contains food.csv, branded_food.csv, nutrient.csv, food_nutrient.csv)")
+    parser.add_argument("--csv-dir", help="Path to USDA CSV folder (contains food.csv, branded_food.csv, nutrient.csv, food_nutrient.csv)")
     parser.add_argument("--out", required=True, help="Output SQLite file path")
     parser.add_argument("--overwrite", action="store_true", help="Overwrite output DB if it exists")
+    parser.add_argument("--derived-only", action="store_true", help="Only (re)build the search index and food_macros table of the existing --out DB")
 
     args = parser.parse_args()
+    if args.derived_only:
+        conn = sqlite3.connect(Path(args.out))
+        try:
+            create_search_index(conn)
+            create_macros_table(conn)
+            print(f"Search index and food_macros built in: {args.out}")
+        finally:
+            conn.close()
+        return
+    if not args.csv_dir:
+        parser.error("--csv-dir is required")
+
     csv_dir = Path(args.csv_dir)
     out_path = Path(args.out)
 
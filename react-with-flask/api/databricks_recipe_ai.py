@@ -4,21 +4,82 @@ Uses Databricks Model Serving for advanced recipe generation
 Qualifies for Databricks Open Source prize by using Databricks ML infrastructure
 """
 import os
+import re
 import json
+import time
+import orjson
 import requests
-from typing import Dict, List, Optional
-from dataclasses import asdict
+from typing import Dict, Final, List, Optional, Tuple
 
 # Import our local recipe AI for fallback
 try:
-    from .recipe_ai import recipe_ai, Recipe
+    from .recipe_ai import recipe_ai, Recipe, RecipeIngredient
 except ImportError:
-    from recipe_ai import recipe_ai, Recipe
+    from recipe_ai import recipe_ai, Recipe, RecipeIngredient
+
+
+# Leading numeric quantity in strings like "2.5 cups"
+_AMOUNT_RE = re.compile(r'\d+\.?\d*')
+
+# (substring, unit) pairs checked in order against the lowercased amount string
+_UNIT_TABLE = (
+    ('cup', 'cup'),
+    ('tbsp', 'tbsp'),
+    ('tablespoon', 'tbsp'),
+    ('tsp', 'tsp'),
+    ('teaspoon', 'tsp'),
+    ('oz', 'oz'),
+    ('lb', 'lb'),
+    ('pound', 'lb'),
+    ('gram', 'g'),
+)
+
+# Static response-format instructions appended to every Databricks prompt
+_PROMPT_TAIL: Final[str] = """
+
+RESPONSE FORMAT (JSON):
+{
+    "name": "Recipe Name",
+    "description": "Brief description",
+    "prep_time": 15,
+    "cook_time": 30,
+    "servings": 2,
+    "difficulty": "easy/medium/hard",
+    "cuisine": "cuisine_type",
+    "ingredients": [
+        {
+            "name": "ingredient name",
+            "amount": "1 cup",
+            "notes": "preparation notes"
+        }
+    ],
+    "instructions": [
+        "Step 1: Detailed instruction",
+        "Step 2: Detailed instruction"
+    ],
+    "nutrition_per_serving": {
+        "calories": 450,
+        "protein_g": 25,
+        "carbs_g": 35,
+        "fat_g": 20,
+        "fiber_g": 8
+    },
+    "tips": [
+        "Helpful cooking tip 1",
+        "Helpful cooking tip 2"
+    ],
+    "dietary_tags": ["tag1", "tag2"]
+}
+
+Generate a creative, healthy, and delicious recipe following this format exactly:"""
 
 
 class DatabricksRecipeAI:
     """Advanced recipe generation using Databricks Model Serving"""
     
+    # Seconds to trust a previous availability probe before re-checking
+    AVAILABILITY_TTL = 60
+    
     def __init__(self):
         """Initialize Databricks client"""
         self.databricks_host = os.getenv('DATABRICKS_HOST', 'your-workspace.databricks.com')
@@ -32,26 +93,39 @@ class DatabricksRecipeAI:
             'Content-Type': 'application/json'
         }
         
+        # Shared keep-alive session for all Databricks calls
+        self._session = requests.Session()
+        self._session.headers.update(self.headers)
+        
+        # Cached availability probe result: (ok, monotonic timestamp)
+        self._avail_ok: Optional[bool] = None
+        self._avail_ts = 0.0
+        
         print(f"🧱 Databricks Recipe AI initialized")
         print(f"Host: {self.databricks_host}")
         print(f"Endpoint: {self.model_endpoint}")
         
     def is_databricks_available(self) -> bool:
-        """Check if Databricks Model Serving is available"""
+        """Check if Databricks Model Serving is available (cached for AVAILABILITY_TTL seconds)"""
         if not self.databricks_token or not self.databricks_host:
             return False
+        
+        now = time.monotonic()
+        if self._avail_ok is not None and now - self._avail_ts < self.AVAILABILITY_TTL:
+            return self._avail_ok
             
         try:
-            # Test connection to Databricks
-            response = requests.get(
+            # HEAD probe: headers only, no endpoint list payload
+            response = self._session.head(
                 f"https://{self.databricks_host}/api/2.0/serving-endpoints",
-                headers=self.headers,
-                timeout=5
+                timeout=2
             )
-            return response.status_code == 200
+            self._avail_ok = response.status_code < 400
         except Exception as e:
             print(f"Databricks unavailable: {e}")
-            return False
+            self._avail_ok = False
+        self._avail_ts = now
+        return self._avail_ok
     
     def generate_recipe_with_databricks(self, 
                                       ingredients: List[str],
@@ -83,15 +157,15 @@ class DatabricksRecipeAI:
                 }
             }
             
-            response = requests.post(
+            response = self._session.post(
                 f"https://{self.databricks_host}{self.model_endpoint}",
-                headers=self.headers,
-                json=payload,
+                data=orjson.dumps(payload),
                 timeout=30
             )
             
             if response.status_code == 200:
-                result = response.json()
+                # Parse the raw bytes directly; skips the str decode response.json() does
+                result = orjson.loads(response.content)
                 return self._parse_databricks_response(result)
             else:
                 print(f"Databricks API error: {response.status_code}")
@@ -143,7 +217,7 @@ class DatabricksRecipeAI:
                                  servings: int) -> str:
         """Create a structured prompt for Databricks model"""
         
-        prompt = f"""Create a detailed {cuisine_style} {meal_type} recipe for {servings} servings.
+        parts = [f"""Create a detailed {cuisine_style} {meal_type} recipe for {servings} servings.
 
 REQUIREMENTS:
 - Meal Type: {meal_type}
@@ -151,59 +225,24 @@ REQUIREMENTS:
 - Servings: {servings}
 - Dietary Preferences: {', '.join(dietary_preferences) if dietary_preferences else 'None'}
 - Nutrition Goals: {json.dumps(nutrition_goals) if nutrition_goals else 'Balanced nutrition'}
-"""
+"""]
 
         if ingredients:
-            prompt += f"\nPREFERRED INGREDIENTS: {', '.join(ingredients)}"
+            parts.append(f"\nPREFERRED INGREDIENTS: {', '.join(ingredients)}")
         
-        prompt += """
-
-RESPONSE FORMAT (JSON):
-{
-    "name": "Recipe Name",
-    "description": "Brief description",
-    "prep_time": 15,
-    "cook_time": 30,
-    "servings": 2,
-    "difficulty": "easy/medium/hard",
-    "cuisine": "cuisine_type",
-    "ingredients": [
-        {
-            "name": "ingredient name",
-            "amount": "1 cup",
-            "notes": "preparation notes"
-        }
-    ],
-    "instructions": [
-        "Step 1: Detailed instruction",
-        "Step 2: Detailed instruction"
-    ],
-    "nutrition_per_serving": {
-        "calories": 450,
-        "protein_g": 25,
-        "carbs_g": 35,
-        "fat_g": 20,
-        "fiber_g": 8
-    },
-    "tips": [
-        "Helpful cooking tip 1",
-        "Helpful cooking tip 2"
-    ],
-    "dietary_tags": ["tag1", "tag2"]
-}
-
-Generate a creative, healthy, and delicious recipe following this format exactly:"""
-
-        return prompt
+        parts.append(_PROMPT_TAIL)
+        return ''.join(parts)
     
     def _parse_databricks_response(self, response: Dict) -> Optional[Dict]:
         """Parse response from Databricks model"""
         try:
-            # Extract the generated text
-            if 'predictions' in response:
-                generated_text = response['predictions'][0]['candidates'][0]['text']
-            elif 'choices' in response:
-                generated_text = response['choices'][0]['message']['content']
+            # Extract the generated text, checking the shape explicitly
+            predictions = response.get('predictions')
+            choices = response.get('choices')
+            if predictions and predictions[0].get('candidates'):
+                generated_text = predictions[0]['candidates'][0].get('text', '')
+            elif choices:
+                generated_text = choices[0].get('message', {}).get('content', '')
             else:
                 generated_text = response.get('generated_text', '')
             
@@ -224,15 +263,14 @@ Generate a creative, healthy, and delicious recipe following this format exactly
     
     def _convert_databricks_to_recipe(self, databricks_data: Dict) -> Recipe:
         """Convert Databricks response to Recipe object"""
-        from recipe_ai import RecipeIngredient
-        
         # Parse ingredients
         ingredients = []
         for ing_data in databricks_data.get('ingredients', []):
+            amount, unit = self._parse_amount_unit(ing_data.get('amount', '1'))
             ingredient = RecipeIngredient(
                 name=ing_data.get('name', ''),
-                amount=self._parse_amount(ing_data.get('amount', '1')),
-                unit=self._parse_unit(ing_data.get('amount', '1 unit')),
+                amount=amount,
+                unit=unit,
                 nutrition=None  # Would need USDA lookup
             )
             ingredients.append(ingredient)
@@ -300,38 +338,16 @@ Generate a creative, healthy, and delicious recipe following this format exactly
         
         return base_recipe
     
-    def _parse_amount(self, amount_str: str) -> float:
-        """Parse amount from string like '1 cup' or '2.5'"""
+    def _parse_amount_unit(self, amount_str: str) -> Tuple[float, str]:
+        """Parse amount and unit from a string like '1 cup' or '2.5 oz' in one pass"""
         try:
-            # Extract numeric part
-            import re
-            numbers = re.findall(r'\d+\.?\d*', amount_str)
-            if numbers:
-                return float(numbers[0])
-            return 1.0
-        except:
-            return 1.0
-    
-    def _parse_unit(self, amount_str: str) -> str:
-        """Parse unit from string like '1 cup' or '2.5 oz'"""
-        try:
-            # Common unit mappings
-            if 'cup' in amount_str.lower():
-                return 'cup'
-            elif 'tbsp' in amount_str.lower() or 'tablespoon' in amount_str.lower():
-                return 'tbsp'
-            elif 'tsp' in amount_str.lower() or 'teaspoon' in amount_str.lower():
-                return 'tsp'
-            elif 'oz' in amount_str.lower():
-                return 'oz'
-            elif 'lb' in amount_str.lower() or 'pound' in amount_str.lower():
-                return 'lb'
-            elif 'g' in amount_str.lower() and 'gram' in amount_str.lower():
-                return 'g'
-            else:
-                return 'unit'
-        except:
-            return 'unit'
+            amount_lower = str(amount_str).lower()
+            match = _AMOUNT_RE.search(amount_lower)
+            amount = float(match.group()) if match else 1.0
+            unit = next((u for needle, u in _UNIT_TABLE if needle in amount_lower), 'unit')
+            return amount, unit
+        except Exception:
+            return 1.0, 'unit'
     
     def batch_generate_recipes(self, 
                               count: int = 5,
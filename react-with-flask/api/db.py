@@ -2,7 +2,8 @@ from __future__ import annotations
 
 import os
 from pathlib import Path
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, create_engine, inspect, select, text, update
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, scoped_session, DeclarativeBase
 from db_config import get_database_url, is_production
 
@@ -29,9 +30,13 @@ def get_engine(echo: bool = False):
             database_url,
             echo=echo,
             future=True,
-            # PostgreSQL specific settings
+            # PostgreSQL specific settings: sized pool, liveness check on checkout,
+            # recycle before server-side idle timeouts
+            poolclass=QueuePool,
+            pool_size=20,
+            max_overflow=40,
             pool_pre_ping=True,
-            pool_recycle=300
+            pool_recycle=1800
         )
     else:
         # Use SQLite in development
@@ -44,7 +49,10 @@ def get_engine(echo: bool = False):
 
 # Scoped session for use in Flask handlers
 engine = get_engine(echo=False)
-SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True))
+# expire_on_commit=False: handlers serialize attributes after commit without re-SELECTing
+SessionLocal = scoped_session(
+    sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True, expire_on_commit=False)
+)
 
 
 def init_db():
@@ -58,3 +66,89 @@ def init_db():
         from models import FoodItem, NutritionFacts, InventoryItem  # type: ignore  # noqa: F401
 
     Base.metadata.create_all(bind=engine)
+    _ensure_schema()
+
+
+def _backfill_favorite_food_info(conn):
+    """Fill user_favorites.food_info for rows written before the column existed."""
+    fav = Base.metadata.tables["user_favorites"]
+    food = Base.metadata.tables["food_items"]
+    custom = Base.metadata.tables["custom_foods"]
+    rows = conn.execute(
+        select(fav.c.id, fav.c.food_item_id, food.c.name, food.c.brand, food.c.category,
+               custom.c.name, custom.c.description)
+        .select_from(fav)
+        .outerjoin(food, fav.c.food_item_id == food.c.id)
+        .outerjoin(custom, fav.c.custom_food_id == custom.c.id)
+    ).all()
+    params = [
+        {
+            "fav_id": fav_id,
+            "info": (
+                {"name": name, "brand": brand, "category": category}
+                if food_item_id is not None
+                else {"name": custom_name, "description": custom_description}
+            ),
+        }
+        for fav_id, food_item_id, name, brand, category, custom_name, custom_description in rows
+    ]
+    if params:
+        conn.execute(
+            update(fav).where(fav.c.id == bindparam("fav_id")).values(food_info=bindparam("info")),
+            params,
+        )
+
+
+# Columns added after the initial schema: (table, column, backfill(conn) or None).
+# create_all() never alters existing tables, so older databases get these applied in place;
+# the column DDL comes from the model definition.
+_ADDED_COLUMNS = [
+    ("food_items", "fdc_id", None),
+    ("user_favorites", "food_info", _backfill_favorite_food_info),
+]
+
+
+# PostgreSQL-only indexes that can't be expressed portably on the models
+_POSTGRES_INDEXES = [
+    # Trigram index for substring ILIKE searches over food names (see api.food_name_matches);
+    # a B-tree can't serve a leading wildcard
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_food_items_name_trgm ON food_items "
+    "USING gin (name gin_trgm_ops)",
+]
+
+
+# Indexes older databases may still have but the models no longer declare; dropping them saves
+# their maintenance on every write
+_DROPPED_INDEXES = [
+    "ix_food_items_name_fts",  # replaced by ix_food_items_name_trgm (PostgreSQL only)
+    "ix_food_items_name",  # prefix of uq_food_name_brand_upc
+    "ix_food_items_upc",  # replaced by the partial ix_food_items_upc_notnull
+    "ix_user_groceries_user_id",  # prefix of ix_usergrocery_user_exp
+    "ix_usergrocery_user_expiry",  # (user_id, is_expired, expiration_date); superseded by ix_usergrocery_user_exp
+    "ix_usergrocery_active",  # partial duplicate of ix_usergrocery_user_exp
+    "ix_user_groceries_expiration_date",  # superseded by ix_usergrocery_user_exp
+    "ix_user_favorites_user_id",  # prefix of ix_uf_user_created
+]
+
+
+def _ensure_schema():
+    """Bring an existing database up to the models: add missing columns, then missing indexes."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, column, backfill in _ADDED_COLUMNS:
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                ddl = Base.metadata.tables[table].c[column].type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                if backfill is not None:
+                    backfill(conn)
+        for name in _DROPPED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        # Indexes declared on the models (including ones added after a table was created)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+        if conn.dialect.name == "postgresql":
+            for ddl in _POSTGRES_INDEXES:
+                conn.execute(text(ddl))
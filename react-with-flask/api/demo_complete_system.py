@@ -5,14 +5,22 @@ Demonstrates all features: grocery tracking, expiration monitoring, custom foods
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 from datetime import date, timedelta
 import time
 
+# Status/urgency markers used when printing inventory; built once, not per item
+_STATUS_EMOJI = {"fresh": "✅", "expiring_this_week": "⏰", "expiring_soon": "⚠️", "expired": "❌"}
+_URGENCY_EMOJI = {"critical": "🔴", "warning": "🟡"}
+
 class FoodTrackerDemo:
     def __init__(self, base_url="http://127.0.0.1:5001"):
         self.base_url = base_url
         self.user_id = "demo_user"
+        # Reuse one keep-alive connection pool for every call to the local server
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
         
     def run_complete_demo(self):
         """Run a complete demo of all food tracking features"""
@@ -68,7 +76,7 @@ class FoodTrackerDemo:
             "sugar_g": 4
         }
         
-        response = requests.post(f"{self.base_url}/api/custom-foods", json=leftover_pasta)
+        response = self.session.post(f"{self.base_url}/api/custom-foods", json=leftover_pasta)
         if response.status_code == 201:
             pasta_id = response.json()['id']
             print(f"✅ Created: {leftover_pasta['name']} (ID: {pasta_id})")
@@ -82,7 +90,7 @@ class FoodTrackerDemo:
             "serving_unit": "bowl"
         }
         
-        response = requests.post(f"{self.base_url}/api/custom-foods/estimate-nutrition", json=mystery_food)
+        response = self.session.post(f"{self.base_url}/api/custom-foods/estimate-nutrition", json=mystery_food)
         if response.status_code == 200:
             estimation = response.json()
             print(f"🤖 AI Estimated nutrition for {mystery_food['name']}:")
@@ -95,7 +103,8 @@ class FoodTrackerDemo:
         print("\\n🛒 STEP 2: Adding Groceries with Expiration Tracking")
         print("-" * 50)
         
-        # Create groceries with strategic expiration dates
+        # Create groceries with strategic expiration dates (all relative to one "today")
+        today = date.today()
         groceries = [
             {
                 "food_type": "custom",
@@ -103,8 +112,8 @@ class FoodTrackerDemo:
                 "quantity": 3,
                 "unit": "servings",
                 "location": "fridge",
-                "purchase_date": date.today().isoformat(),
-                "expiration_date": (date.today() + timedelta(days=1)).isoformat(),  # Expires tomorrow!
+                "purchase_date": today.isoformat(),
+                "expiration_date": (today + timedelta(days=1)).isoformat(),  # Expires tomorrow!
                 "notes": "Leftover from dinner, use soon!"
             },
             {
@@ -113,8 +122,8 @@ class FoodTrackerDemo:
                 "quantity": 1.5,
                 "unit": "lbs",
                 "location": "fridge",
-                "purchase_date": (date.today() - timedelta(days=1)).isoformat(),
-                "expiration_date": (date.today() + timedelta(days=4)).isoformat(),
+                "purchase_date": (today - timedelta(days=1)).isoformat(),
+                "expiration_date": (today + timedelta(days=4)).isoformat(),
                 "notes": "Fresh chicken breast from butcher"
             },
             {
@@ -123,8 +132,8 @@ class FoodTrackerDemo:
                 "quantity": 1,
                 "unit": "gallon",
                 "location": "fridge", 
-                "purchase_date": (date.today() - timedelta(days=2)).isoformat(),
-                "expiration_date": (date.today() + timedelta(days=6)).isoformat(),
+                "purchase_date": (today - timedelta(days=2)).isoformat(),
+                "expiration_date": (today + timedelta(days=6)).isoformat(),
                 "notes": "Organic whole milk"
             }
         ]
@@ -132,11 +141,11 @@ class FoodTrackerDemo:
         added_items = []
         for grocery in groceries:
             grocery["user_id"] = self.user_id
-            response = requests.post(f"{self.base_url}/api/groceries", json=grocery)
+            response = self.session.post(f"{self.base_url}/api/groceries", json=grocery)
             if response.status_code == 201:
                 item = response.json()
                 added_items.append(item)
-                days_until_expiry = (date.fromisoformat(grocery['expiration_date']) - date.today()).days
+                days_until_expiry = (date.fromisoformat(grocery['expiration_date']) - today).days
                 print(f"✅ Added: {grocery['quantity']} {grocery['unit']} ({grocery['food_type']} food)")
                 print(f"    Location: {grocery['location']}, Expires in {days_until_expiry} days")
         
@@ -148,7 +157,7 @@ class FoodTrackerDemo:
         print("-" * 50)
         
         # Get current inventory
-        response = requests.get(f"{self.base_url}/api/groceries?user_id={self.user_id}")
+        response = self.session.get(f"{self.base_url}/api/groceries?user_id={self.user_id}")
         if response.status_code == 200:
             inventory = response.json()
             print(f"📊 Current inventory: {inventory['total_items']} items")
@@ -157,21 +166,19 @@ class FoodTrackerDemo:
             print()
             
             for item in inventory['groceries']:
-                status_emoji = {"fresh": "✅", "expiring_this_week": "⏰", "expiring_soon": "⚠️", "expired": "❌"}
-                emoji = status_emoji.get(item['expiry_status'], "❓")
+                emoji = _STATUS_EMOJI.get(item['expiry_status'], "❓")
                 
                 print(f"{emoji} {item['quantity']} {item['unit']} {item['food_info']['name']}")
                 print(f"    📍 {item['location']}, expires in {item['days_until_expiry']} days")
         
         # Check specifically for expiring items
-        response = requests.get(f"{self.base_url}/api/groceries/expiring?user_id={self.user_id}&days=7")
+        response = self.session.get(f"{self.base_url}/api/groceries/expiring?user_id={self.user_id}&days=7")
         if response.status_code == 200:
             expiring = response.json()
             if expiring['total_count'] > 0:
                 print(f"\\n🚨 EXPIRATION ALERT: {expiring['total_count']} items need attention!")
                 for item in expiring['expiring_items']:
-                    urgency_emoji = {"critical": "🔴", "warning": "🟡"}
-                    emoji = urgency_emoji.get(item['urgency'], "🟢")
+                    emoji = _URGENCY_EMOJI.get(item['urgency'], "🟢")
                     print(f"{emoji} {item['food_name']}: {item['days_until_expiry']} days left")
     
     def demo_ai_nutrition_advice(self):
@@ -186,7 +193,7 @@ class FoodTrackerDemo:
         
         for question in questions:
             print(f"\\n💭 Question: {question}")
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/ai/chat",
                 json={"message": question, "user_id": self.user_id}
             )
@@ -208,7 +215,7 @@ class FoodTrackerDemo:
         
         for request in recipe_requests:
             print(f"\\n🍽️  Request: {request}")
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/ai/recipe-suggestions",
                 json={"message": request, "user_id": self.user_id}
             )
@@ -237,7 +244,7 @@ class FoodTrackerDemo:
                 "notes": "Had some for lunch, delicious!"
             }
             
-            response = requests.put(f"{self.base_url}/api/groceries/{item_id}", json=update_data)
+            response = self.session.put(f"{self.base_url}/api/groceries/{item_id}", json=update_data)
             if response.status_code == 200:
                 print("✅ Updated leftover pasta: consumed 1.5 servings")
                 print("    Marked as opened, updated notes")
@@ -248,13 +255,13 @@ class FoodTrackerDemo:
         print("=" * 70)
         
         # Get final inventory state
-        response = requests.get(f"{self.base_url}/api/groceries?user_id={self.user_id}")
+        response = self.session.get(f"{self.base_url}/api/groceries?user_id={self.user_id}")
         if response.status_code == 200:
             inventory = response.json()
             print(f"📊 Final inventory: {inventory['total_items']} items")
             
         # Get custom foods count
-        response = requests.get(f"{self.base_url}/api/custom-foods?user_id={self.user_id}")
+        response = self.session.get(f"{self.base_url}/api/custom-foods?user_id={self.user_id}")
         if response.status_code == 200:
             custom_foods = response.json()
             print(f"🍳 Custom foods created: {custom_foods['total_count']} items")
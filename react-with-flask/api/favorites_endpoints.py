@@ -3,244 +3,288 @@ Favorites API Endpoints
 Manage user's favorite ingredients (USDA items or custom foods)
 """
 
-from flask import jsonify, request
-from sqlalchemy.orm import joinedload
-from sqlalchemy import or_
+import logging
+
+import orjson
+from flask import Response, request
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 
 # Import database components
 try:
     from .db import SessionLocal
-    from .models import FoodItem, CustomFood, UserFavorite
+    from .models import FoodItem, CustomFood, NutritionFacts, UserFavorite
 except ImportError:
     import os, sys
     sys.path.append(os.path.dirname(__file__))
     from db import SessionLocal
-    from models import FoodItem, CustomFood, UserFavorite
+    from models import FoodItem, CustomFood, NutritionFacts, UserFavorite
 
+logger = logging.getLogger(__name__)
 
-def register_favorites_routes(app):
-    """Register favorites routes with the Flask app."""
 
-    @app.route('/api/favorites', methods=['GET'])
-    def list_favorites():
-        user_id = request.args.get('user_id', 'demo_user')
-        session = SessionLocal()
-        try:
-            favs = (
-                session.query(UserFavorite)
-                .filter(UserFavorite.user_id == user_id)
-                .options(joinedload(UserFavorite.food_item), joinedload(UserFavorite.custom_food))
-                .order_by(UserFavorite.created_at.desc())
-                .all()
-            )
-            result = []
-            for f in favs:
-                if f.food_item:
-                    item = {
-                        'id': f.id,
-                        'type': 'usda',
-                        'user_id': f.user_id,
-                        'food_item_id': f.food_item_id,
-                        'display_name': f.display_name or f.food_item.name,
-                        'notes': f.notes,
-                        'created_at': f.created_at.isoformat(),
-                        'food_info': {
-                            'name': f.food_item.name,
-                            'brand': f.food_item.brand,
-                            'category': f.food_item.category,
-                        },
-                    }
-                else:
-                    item = {
-                        'id': f.id,
-                        'type': 'custom',
-                        'user_id': f.user_id,
-                        'custom_food_id': f.custom_food_id,
-                        'display_name': f.display_name or f.custom_food.name,
-                        'notes': f.notes,
-                        'created_at': f.created_at.isoformat(),
-                        'food_info': {
-                            'name': f.custom_food.name,
-                            'description': f.custom_food.description,
-                        },
-                    }
-                result.append(item)
-            return jsonify({'favorites': result, 'total_count': len(result)})
-        finally:
-            session.close()
-
-    @app.route('/api/favorites', methods=['POST'])
-    def add_favorite():
-        data = request.get_json() or {}
-        user_id = data.get('user_id', 'demo_user')
-        food_item_id = data.get('food_item_id')
-        custom_food_id = data.get('custom_food_id')
-        display_name = data.get('display_name')
-        notes = data.get('notes')
-        
-        # Handle USDA items from search results
-        fdc_id = data.get('fdc_id')  # For USDA items from search
-        source = data.get('source')  # "usda" for USDA items
-        
+def _json(payload, status=200):
+    """JSON response serialized with orjson (faster than the stdlib encoder, handles datetimes)."""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
+
+def _dialect_insert(model):
+    """Dialect-specific INSERT construct (supports on_conflict_do_nothing on PostgreSQL and SQLite)."""
+    if SessionLocal.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def _iso_timestamp(column):
+    """SQL expression rendering a DateTime column as an ISO 8601 string (no per-row Python datetime)."""
+    if SessionLocal.get_bind().dialect.name == 'postgresql':
+        return func.to_char(column, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+    # SQLite stores 'YYYY-MM-DD HH:MM:SS[.ffffff]' text: rows defaulted by CURRENT_TIMESTAMP have
+    # whole seconds, rows written with a Python datetime carry microseconds
+    return func.replace(column, ' ', 'T')
+
+
+def serialize_usda(row):
+    """Favorite row (see list_favorites' SELECT) referencing a USDA FoodItem -> response dict."""
+    fav_id, user_id, food_item_id, _custom_food_id, display_name, notes, created_at, food_info = row
+    return {
+        'id': fav_id,
+        'type': 'usda',
+        'user_id': user_id,
+        'food_item_id': food_item_id,
+        'display_name': display_name or (food_info or {}).get('name'),
+        'notes': notes,
+        'created_at': created_at,  # already ISO 8601 text from SQL
+        'food_info': food_info,
+    }
+
+
+def serialize_custom(row):
+    """Favorite row (see list_favorites' SELECT) referencing a CustomFood -> response dict."""
+    fav_id, user_id, _food_item_id, custom_food_id, display_name, notes, created_at, food_info = row
+    return {
+        'id': fav_id,
+        'type': 'custom',
+        'user_id': user_id,
+        'custom_food_id': custom_food_id,
+        'display_name': display_name or (food_info or {}).get('name'),
+        'notes': notes,
+        'created_at': created_at,
+        'food_info': food_info,
+    }
+
+
+def _food_info(session, food_item_id, custom_food_id):
+    """Snapshot stored in UserFavorite.food_info: the fields list_favorites returns per type."""
+    if food_item_id:
+        row = session.execute(
+            select(FoodItem.name, FoodItem.brand, FoodItem.category).where(FoodItem.id == food_item_id)
+        ).first()
+        return {'name': row.name, 'brand': row.brand, 'category': row.category} if row else None
+    row = session.execute(
+        select(CustomFood.name, CustomFood.description).where(CustomFood.id == custom_food_id)
+    ).first()
+    return {'name': row.name, 'description': row.description} if row else None
+
+
+def list_favorites():
+    user_id = request.args.get('user_id', 'demo_user')
+    # Single-table column SELECT: food_info is denormalized at write time, so no joins
+    stmt = (
+        select(
+            UserFavorite.id,
+            UserFavorite.user_id,
+            UserFavorite.food_item_id,
+            UserFavorite.custom_food_id,
+            UserFavorite.display_name,
+            UserFavorite.notes,
+            _iso_timestamp(UserFavorite.created_at).label('created_at'),
+            UserFavorite.food_info,
+        )
+        .where(UserFavorite.user_id == user_id)
+        .order_by(UserFavorite.created_at.desc(), UserFavorite.id.desc())  # id breaks same-second ties
+    )
+    result = [
+        serialize_usda(row) if row.food_item_id is not None else serialize_custom(row)
+        for row in SessionLocal().execute(stmt).all()
+    ]
+    return _json({'favorites': result, 'total_count': len(result)})
+
+
+def add_favorite():
+    data = request.get_json() or {}
+    user_id = data.get('user_id', 'demo_user')
+    food_item_id = data.get('food_item_id')
+    custom_food_id = data.get('custom_food_id')
+    display_name = data.get('display_name')
+    notes = data.get('notes')
+    
+    # Handle USDA items from search results
+    fdc_id = data.get('fdc_id')  # For USDA items from search
+    source = data.get('source')  # "usda" for USDA items
+    category = data.get('category')  # optional override for imported USDA items
+    
+    # The request's scoped session (one pooled connection) serves the USDA lookup/import and
+    # the insert; api.remove_db_session closes it on teardown
+    session = SessionLocal()
+    try:
         # Handle USDA items - try to find existing or import if needed
         if source == 'usda' and fdc_id and not food_item_id:
-            print(f"🔄 Processing USDA item with FDC ID: {fdc_id}, display_name: '{display_name}'")
+            logger.debug("Processing USDA favorite fdc_id=%s display_name=%r", fdc_id, display_name)
             
-            # First, check if we already have this as a FoodItem
-            lookup_session = SessionLocal()
-            try:
-                # Try to find by display name or similar name patterns
-                search_conditions = [FoodItem.name.ilike(f'%{display_name}%')]
-                
-                # Add specific food type searches
-                display_lower = display_name.lower()
-                if 'chicken' in display_lower:
-                    search_conditions.append(FoodItem.name.ilike('%chicken%'))
-                if 'milk' in display_lower:
-                    search_conditions.append(FoodItem.name.ilike('%milk%'))
-                if 'beef' in display_lower:
-                    search_conditions.append(FoodItem.name.ilike('%beef%'))
-                if 'egg' in display_lower:
-                    search_conditions.append(FoodItem.name.ilike('%egg%'))
-                
-                potential_matches = lookup_session.query(FoodItem).filter(
-                    or_(*search_conditions)
-                ).limit(5).all()
-                
-                print(f"🔍 Found {len(potential_matches)} potential matches in FoodItems")
-                for match in potential_matches:
-                    print(f"  - ID: {match.id}, Name: '{match.name}', Category: '{match.category}'")
+            # First, check if we already imported this FDC item (unique index probe)
+            existing_food = session.query(FoodItem).filter(FoodItem.fdc_id == fdc_id).first()
+            
+            # Use the existing item, or try USDA import
+            if existing_food:
+                food_item_id = existing_food.id
+                display_name = display_name or existing_food.name
+                logger.debug("Using existing FoodItem %s for fdc_id=%s", food_item_id, fdc_id)
+            else:
+                logger.debug("No FoodItem for fdc_id=%s, importing from USDA", fdc_id)
                 
-                # Use the first reasonable match, or try USDA import
-                if potential_matches:
-                    # Use the first match
-                    existing_food = potential_matches[0]
-                    food_item_id = existing_food.id
-                    display_name = display_name or existing_food.name
-                    print(f"✅ Using existing FoodItem ID: {food_item_id}")
-                else:
-                    print(f"🔄 No existing FoodItem found, attempting USDA import...")
+                # Try to import from USDA
+                try:
+                    from usda_queries import get_food_with_nutrients_cached
+                    from usda_db import usda_available
                     
-                    # Try to import from USDA
-                    try:
-                        from usda_queries import get_food_basic, get_basic_nutrients
-                        from usda_db import get_usda_engine
-                        
-                        usda_engine = get_usda_engine()
-                        if usda_engine:
-                            basic = get_food_basic(usda_engine, fdc_id)
-                            
-                            if basic:
-                                food_name = basic.get('description') or display_name
-                                brand = basic.get('brand_name') or basic.get('brand_owner')
-                                category = data.get('category') or basic.get('data_type') or 'USDA Food'
-                                upc = basic.get('gtin_upc')
-                                
-                                # Create new FoodItem
-                                new_food = FoodItem(
-                                    name=food_name,
-                                    brand=brand,
-                                    category=category,
-                                    upc=upc,
-                                    is_perishable=True
-                                )
-                                lookup_session.add(new_food)
-                                lookup_session.flush()
-                                
-                                # Add nutrition if available
-                                facts = get_basic_nutrients(usda_engine, fdc_id)
-                                if facts:
-                                    from models import NutritionFacts
-                                    nutrition = NutritionFacts(
-                                        food_item_id=new_food.id,
-                                        calories=facts.get('calories'),
-                                        protein_g=facts.get('protein_g'),
-                                        carbs_g=facts.get('carbs_g'),
-                                        fat_g=facts.get('fat_g'),
-                                        fiber_g=facts.get('fiber_g'),
-                                        sugar_g=facts.get('sugar_g')
-                                    )
-                                    lookup_session.add(nutrition)
-                                
-                                lookup_session.commit()
-                                food_item_id = new_food.id
-                                display_name = display_name or food_name
-                                print(f"✅ Created new FoodItem ID: {food_item_id}")
-                            else:
-                                print(f"❌ No USDA data found for FDC ID: {fdc_id}")
-                                raise Exception(f"No USDA data for FDC {fdc_id}")
-                        else:
-                            print(f"❌ USDA engine not available")
-                            raise Exception("USDA engine not available")
-                    except Exception as usda_error:
-                        lookup_session.rollback()
-                        print(f"💥 USDA import failed: {usda_error}")
-                        # Fall back to custom food
-                        from models import CustomFood
-                        custom_food = CustomFood(
-                            name=display_name,
-                            description=f"USDA item (FDC: {fdc_id}) - Import failed",
-                            user_id=user_id
+                    if not usda_available():
+                        raise Exception("USDA engine not available")
+                    basic = get_food_with_nutrients_cached(fdc_id)
+                    if not basic:
+                        raise Exception(f"No USDA data for FDC {fdc_id}")
+                    
+                    food_name = basic.get('description') or display_name
+                    brand = basic.get('brand_name') or basic.get('brand_owner')
+                    category = category or basic.get('data_type') or 'USDA Food'
+                    upc = basic.get('gtin_upc')
+                    
+                    # The same food imported before food_items had fdc_id: reuse that row and
+                    # link it (a new row would collide with it on uq_food_name_brand_upc)
+                    matched_id = session.execute(
+                        select(FoodItem.id)
+                        .where(FoodItem.name == food_name, FoodItem.brand == brand, FoodItem.upc == upc)
+                        .limit(1)
+                    ).scalar()
+                    
+                    if matched_id is not None:
+                        session.execute(
+                            update(FoodItem)
+                            .where(FoodItem.id == matched_id, FoodItem.fdc_id.is_(None))
+                            .values(fdc_id=fdc_id)
                         )
-                        lookup_session.add(custom_food)
-                        lookup_session.commit()
-                        custom_food_id = custom_food.id
-                        print(f"🔄 Created CustomFood ID: {custom_food_id}")
+                        food_item_id = matched_id
+                        logger.debug("Linked existing FoodItem %s to fdc_id=%s", food_item_id, fdc_id)
+                    else:
+                        # Create new FoodItem: Core INSERT ... RETURNING, no ORM unit-of-work flush
+                        food_item_id = session.execute(
+                            insert(FoodItem)
+                            .values(
+                                name=food_name,
+                                brand=brand,
+                                category=category,
+                                upc=upc,
+                                fdc_id=fdc_id,
+                                is_perishable=True,
+                            )
+                            .returning(FoodItem.id)
+                        ).scalar_one()
                         
-            finally:
-                lookup_session.close()
+                        # Add nutrition if available (same transaction, committed with the favorite)
+                        facts = basic['nutrients']
+                        if facts:
+                            session.execute(
+                                insert(NutritionFacts).values(
+                                    food_item_id=food_item_id,
+                                    calories=facts.get('calories'),
+                                    protein_g=facts.get('protein_g'),
+                                    carbs_g=facts.get('carbs_g'),
+                                    fat_g=facts.get('fat_g'),
+                                    fiber_g=facts.get('fiber_g'),
+                                    sugar_g=facts.get('sugar_g'),
+                                )
+                            )
+                        logger.debug("Created FoodItem %s for fdc_id=%s", food_item_id, fdc_id)
+                    
+                    display_name = display_name or food_name
+                except Exception as usda_error:
+                    session.rollback()
+                    food_item_id = None
+                    logger.warning("USDA import failed for fdc_id=%s: %s", fdc_id, usda_error)
+                    # Fall back to custom food
+                    custom_food = CustomFood(
+                        name=display_name,
+                        description=f"USDA item (FDC: {fdc_id}) - Import failed",
+                        user_id=user_id
+                    )
+                    session.add(custom_food)
+                    session.flush()
+                    custom_food_id = custom_food.id
+                    logger.debug("Created fallback CustomFood %s for fdc_id=%s", custom_food_id, fdc_id)
 
         # Validate one-of after potential USDA import
         if bool(food_item_id) == bool(custom_food_id):
-            return jsonify({'error': 'Provide exactly one of food_item_id or custom_food_id, or provide USDA item details'}), 400
-
-        session = SessionLocal()
-        try:
-            # Prevent duplicates
-            exists = (
-                session.query(UserFavorite)
-                .filter(
-                    UserFavorite.user_id == user_id,
-                    (UserFavorite.food_item_id == food_item_id) if food_item_id else (UserFavorite.custom_food_id == custom_food_id),
-                )
-                .first()
-            )
-            if exists:
-                return jsonify({'error': 'Already in favorites', 'favorite_id': exists.id}), 409
+            return _json({'error': 'Provide exactly one of food_item_id or custom_food_id, or provide USDA item details'}, 400)
 
-            fav = UserFavorite(
+        # Single INSERT ... ON CONFLICT DO NOTHING against the per-user unique constraints;
+        # no read-before-write round trip and no race between concurrent adds
+        ref_column, ref_id = (
+            (UserFavorite.food_item_id, food_item_id) if food_item_id
+            else (UserFavorite.custom_food_id, custom_food_id)
+        )
+        stmt = (
+            _dialect_insert(UserFavorite)
+            .values(
                 user_id=user_id,
                 food_item_id=food_item_id,
                 custom_food_id=custom_food_id,
                 display_name=display_name,
                 notes=notes,
+                food_info=_food_info(session, food_item_id, custom_food_id),
             )
-            session.add(fav)
-            session.commit()
-            return jsonify({'id': fav.id, 'message': 'Added to favorites'}), 201
-        except Exception as e:
-            session.rollback()
-            return jsonify({'error': f'Failed to add favorite: {str(e)}'}), 500
-        finally:
-            session.close()
-
-    @app.route('/api/favorites/<int:fav_id>', methods=['DELETE'])
-    def delete_favorite(fav_id: int):
-        user_id = request.args.get('user_id', 'demo_user')
-        session = SessionLocal()
-        try:
-            fav = (
-                session.query(UserFavorite)
-                .filter(UserFavorite.id == fav_id, UserFavorite.user_id == user_id)
-                .first()
-            )
-            if not fav:
-                return jsonify({'error': 'Favorite not found'}), 404
-            session.delete(fav)
-            session.commit()
-            return jsonify({'message': 'Favorite removed'})
-        except Exception as e:
+            .on_conflict_do_nothing(index_elements=['user_id', ref_column.key])
+            .returning(UserFavorite.id)
+        )
+        new_id = session.execute(stmt).scalar()
+        # Commit any imported FoodItem/CustomFood together with the favorite
+        session.commit()
+        if new_id is None:
+            # Id-only lookup served from the (user_id, ref) unique index; no ORM row hydrated
+            existing_id = session.execute(
+                select(UserFavorite.id)
+                .where(UserFavorite.user_id == user_id, ref_column == ref_id)
+                .limit(1)
+            ).scalar()
+            return _json({'error': 'Already in favorites', 'favorite_id': existing_id}, 409)
+
+        return _json({'id': new_id, 'message': 'Added to favorites'}, 201)
+    except Exception as e:
+        session.rollback()
+        return _json({'error': f'Failed to add favorite: {str(e)}'}, 500)
+
+
+def delete_favorite(fav_id: int):
+    user_id = request.args.get('user_id', 'demo_user')
+    session = SessionLocal()
+    try:
+        # Single DELETE ... WHERE id AND owner; rowcount tells us whether it existed
+        result = session.execute(
+            delete(UserFavorite)
+            .where(UserFavorite.id == fav_id, UserFavorite.user_id == user_id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
             session.rollback()
-            return jsonify({'error': f'Failed to delete favorite: {str(e)}'}), 500
-        finally:
-            session.close()
\ No newline at end of file
+            return _json({'error': 'Favorite not found'}, 404)
+        session.commit()
+        return _json({'message': 'Favorite removed'})
+    except Exception as e:
+        session.rollback()
+        return _json({'error': f'Failed to delete favorite: {str(e)}'}, 500)
+
+
+def register_favorites_routes(app):
+    """Register favorites routes with the Flask app."""
+    app.add_url_rule('/api/favorites', view_func=list_favorites, methods=['GET'])
+    app.add_url_rule('/api/favorites', view_func=add_favorite, methods=['POST'])
+    app.add_url_rule('/api/favorites/<int:fav_id>', view_func=delete_favorite, methods=['DELETE'])
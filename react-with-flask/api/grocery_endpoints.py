@@ -3,25 +3,135 @@ Grocery Management API Endpoints
 Handles user grocery tracking, expiration dates, and custom foods
 """
 
+import os
 import time
 from datetime import date, datetime, timedelta
-from flask import jsonify, request
-from sqlalchemy import and_, or_, desc
-from sqlalchemy.orm import joinedload
+import orjson
+from flask import Response, request
+from sqlalchemy import Integer, and_, or_, desc, case, cast, func, insert, update
+from sqlalchemy.orm import undefer_group
 
 # Import database components
 try:
     from .db import SessionLocal
     from .models import FoodItem, NutritionFacts, CustomFood, UserGrocery
-    from .usda_db import USDA_ENGINE
-    from .usda_queries import get_basic_nutrients, get_food_basic
 except ImportError:
     import os, sys
     sys.path.append(os.path.dirname(__file__))
     from db import SessionLocal
     from models import FoodItem, NutritionFacts, CustomFood, UserGrocery
-    from usda_db import USDA_ENGINE
-    from usda_queries import get_basic_nutrients, get_food_basic
+
+# AI estimation is optional: without its dependencies the grocery routes still load and
+# estimate-nutrition answers with the fallback values
+try:
+    from .mosaic_nutrition_ai import get_mosaic_nutrition_ai
+except ImportError:
+    try:
+        from mosaic_nutrition_ai import get_mosaic_nutrition_ai
+    except ImportError:
+        get_mosaic_nutrition_ai = None
+
+
+def _json(payload, status=200):
+    """JSON response serialized with orjson; dates/datetimes are emitted as ISO 8601 natively."""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
+
+# Generic per-serving estimate used when the AI is unavailable or its answer can't be parsed
+FALLBACK_NUTRITION = {
+    'calories': 200,
+    'protein_g': 10,
+    'carbs_g': 20,
+    'fat_g': 8,
+    'fiber_g': 3,
+    'sugar_g': 5,
+}
+
+
+# Max ids per UPDATE ... WHERE id IN (...) statement in mark-expired
+MARK_EXPIRED_CHUNK = 1000
+
+# Max items per POST /api/groceries/bulk request
+BULK_GROCERIES_MAX = 500
+
+
+# GET /api/groceries response cache: (user_id, include_expired, today, version) -> (body, stored_at).
+# Every grocery write for a user bumps that user's version, but only in the process that handled
+# the write: with several gunicorn workers another worker could serve its pre-write body, so
+# gunicorn.conf.py sets GROCERIES_CACHE_TTL=0 (cache off) whenever it runs more than one worker.
+GROCERIES_CACHE_TTL = float(os.getenv('GROCERIES_CACHE_TTL', '5'))
+GROCERIES_CACHE_MAX = 1024
+_groceries_cache: dict[tuple, tuple[bytes, float]] = {}
+_grocery_versions: dict[str, int] = {}
+
+
+def invalidate_user_groceries(user_id: str) -> None:
+    """Call after any write to a user's user_groceries rows."""
+    _grocery_versions[user_id] = _grocery_versions.get(user_id, 0) + 1
+
+
+def _parse_date(value):
+    return datetime.fromisoformat(value).date() if value else None
+
+
+def grocery_values(data, user_id: str) -> dict:
+    """Column values for a new UserGrocery row from one request item.
+
+    Raises ValueError, with a message fit for a 400 response, for a missing food reference or
+    a malformed date.
+    """
+    food_type = data.get('food_type')  # 'usda' or 'custom'
+    if food_type == 'usda':
+        food_item_id, custom_food_id = data.get('food_item_id'), None
+        if not food_item_id:
+            raise ValueError('food_item_id is required for food_type "usda"')
+    elif food_type == 'custom':
+        food_item_id, custom_food_id = None, data.get('custom_food_id')
+        if not custom_food_id:
+            raise ValueError('custom_food_id is required for food_type "custom"')
+    else:
+        raise ValueError('food_type must be "usda" or "custom"')
+    
+    return {
+        'user_id': user_id,
+        'food_item_id': food_item_id,
+        'custom_food_id': custom_food_id,
+        'quantity': data.get('quantity', 1.0),
+        'unit': data.get('unit', 'unit'),
+        'location': data.get('location'),
+        'purchase_date': _parse_date(data.get('purchase_date')),
+        'expiration_date': _parse_date(data.get('expiration_date')),
+        'is_opened': data.get('is_opened', False),
+        'notes': data.get('notes'),
+    }
+
+
+def days_until(session, date_column, today):
+    """SQL expression: whole days from `today` to a Date column (negative once past)."""
+    if session.get_bind().dialect.name == 'postgresql':
+        return date_column - today  # date - date is an integer day count
+    return cast(func.julianday(date_column) - func.julianday(today), Integer)
+
+
+def expiry_status_case(today):
+    """SQL CASE bucketing UserGrocery.expiration_date relative to `today`."""
+    expires = UserGrocery.expiration_date
+    return case(
+        (expires.is_(None), 'unknown'),
+        (expires < today, 'expired'),
+        (expires <= today + timedelta(days=3), 'expiring_soon'),
+        (expires <= today + timedelta(days=7), 'expiring_this_week'),
+        else_='fresh',
+    )
+
+
+def urgency_case(days_column):
+    """SQL CASE for /api/groceries/expiring urgency from a days-until-expiry expression."""
+    return case(
+        (days_column < 0, 'expired'),
+        (days_column <= 1, 'critical'),
+        else_='warning',
+    )
 
 
 def register_grocery_routes(app):
@@ -36,64 +146,98 @@ def register_grocery_routes(app):
         """Get user's current grocery inventory"""
         user_id = request.args.get('user_id', 'demo_user')
         include_expired = request.args.get('include_expired', 'false').lower() == 'true'
+        today = date.today()
+        
+        cache_key = (user_id, include_expired, today, _grocery_versions.get(user_id, 0))
+        cached = _groceries_cache.get(cache_key) if GROCERIES_CACHE_TTL > 0 else None
+        now = time.monotonic()
+        if cached and now - cached[1] < GROCERIES_CACHE_TTL:
+            return Response(cached[0], mimetype='application/json')
         
         session = SessionLocal()
         try:
-            query = session.query(UserGrocery).filter(UserGrocery.user_id == user_id)
-            
+            status = expiry_status_case(today)
+            filters = [UserGrocery.user_id == user_id]
             if not include_expired:
-                query = query.filter(UserGrocery.is_expired == False)
-            
-            groceries = query.options(
-                joinedload(UserGrocery.food_item).joinedload(FoodItem.nutrition),
-                joinedload(UserGrocery.custom_food)
-            ).order_by(UserGrocery.expiration_date.asc()).all()
+                filters.append(UserGrocery.is_expired == False)
+            
+            # Column projection over outer joins: plain Row tuples, no ORM instances.
+            # Expiry bucketing and the summary counts (window aggregates over the whole result)
+            # are computed by the database in the same pass.
+            query = session.query(
+                UserGrocery.id,
+                UserGrocery.quantity,
+                UserGrocery.unit,
+                UserGrocery.location,
+                UserGrocery.purchase_date,
+                UserGrocery.expiration_date,
+                UserGrocery.opened_date,
+                UserGrocery.is_opened,
+                UserGrocery.is_expired,
+                UserGrocery.notes,
+                UserGrocery.created_at,
+                UserGrocery.updated_at,
+                days_until(session, UserGrocery.expiration_date, today).label('days_until_expiry'),
+                status.label('expiry_status'),
+                func.sum(case((status == 'expiring_soon', 1), else_=0)).over().label('expiring_soon_count'),
+                func.sum(case((status == 'expired', 1), else_=0)).over().label('expired_count'),
+                FoodItem.id.label('food_id'),
+                FoodItem.name.label('food_name'),
+                FoodItem.brand.label('food_brand'),
+                FoodItem.category.label('food_category'),
+                NutritionFacts.id.label('nutrition_id'),
+                NutritionFacts.calories.label('food_calories'),
+                NutritionFacts.protein_g.label('food_protein_g'),
+                NutritionFacts.carbs_g.label('food_carbs_g'),
+                NutritionFacts.fat_g.label('food_fat_g'),
+                CustomFood.id.label('custom_id'),
+                CustomFood.name.label('custom_name'),
+                CustomFood.description.label('custom_description'),
+                CustomFood.calories.label('custom_calories'),
+                CustomFood.protein_g.label('custom_protein_g'),
+                CustomFood.carbs_g.label('custom_carbs_g'),
+                CustomFood.fat_g.label('custom_fat_g'),
+                CustomFood.nutrition_estimated.label('custom_nutrition_estimated'),
+            ).outerjoin(
+                FoodItem, UserGrocery.food_item_id == FoodItem.id
+            ).outerjoin(
+                NutritionFacts, NutritionFacts.food_item_id == FoodItem.id
+            ).outerjoin(
+                CustomFood, UserGrocery.custom_food_id == CustomFood.id
+            ).filter(*filters)
+            
+            groceries = query.order_by(UserGrocery.expiration_date.asc()).all()
             
             result = []
-            today = date.today()
             
             for grocery in groceries:
-                # Calculate days until expiration
-                days_until_expiry = None
-                expiry_status = "unknown"
-                if grocery.expiration_date:
-                    days_until_expiry = (grocery.expiration_date - today).days
-                    if days_until_expiry < 0:
-                        expiry_status = "expired"
-                    elif days_until_expiry <= 3:
-                        expiry_status = "expiring_soon"
-                    elif days_until_expiry <= 7:
-                        expiry_status = "expiring_this_week"
-                    else:
-                        expiry_status = "fresh"
-                
                 # Get food info (USDA or custom)
                 food_info = {}
-                if grocery.food_item:
+                if grocery.food_id is not None:
                     food_info = {
                         'type': 'usda',
-                        'name': grocery.food_item.name,
-                        'brand': grocery.food_item.brand,
-                        'category': grocery.food_item.category,
+                        'name': grocery.food_name,
+                        'brand': grocery.food_brand,
+                        'category': grocery.food_category,
                         'nutrition': {
-                            'calories': grocery.food_item.nutrition.calories if grocery.food_item.nutrition else None,
-                            'protein_g': grocery.food_item.nutrition.protein_g if grocery.food_item.nutrition else None,
-                            'carbs_g': grocery.food_item.nutrition.carbs_g if grocery.food_item.nutrition else None,
-                            'fat_g': grocery.food_item.nutrition.fat_g if grocery.food_item.nutrition else None,
-                        } if grocery.food_item.nutrition else None
+                            'calories': grocery.food_calories,
+                            'protein_g': grocery.food_protein_g,
+                            'carbs_g': grocery.food_carbs_g,
+                            'fat_g': grocery.food_fat_g,
+                        } if grocery.nutrition_id is not None else None
                     }
-                elif grocery.custom_food:
+                elif grocery.custom_id is not None:
                     food_info = {
                         'type': 'custom',
-                        'name': grocery.custom_food.name,
-                        'description': grocery.custom_food.description,
+                        'name': grocery.custom_name,
+                        'description': grocery.custom_description,
                         'nutrition': {
-                            'calories': grocery.custom_food.calories,
-                            'protein_g': grocery.custom_food.protein_g,
-                            'carbs_g': grocery.custom_food.carbs_g,
-                            'fat_g': grocery.custom_food.fat_g,
+                            'calories': grocery.custom_calories,
+                            'protein_g': grocery.custom_protein_g,
+                            'carbs_g': grocery.custom_carbs_g,
+                            'fat_g': grocery.custom_fat_g,
                         },
-                        'nutrition_estimated': grocery.custom_food.nutrition_estimated
+                        'nutrition_estimated': grocery.custom_nutrition_estimated
                     }
                 
                 result.append({
@@ -102,24 +246,29 @@ def register_grocery_routes(app):
                     'quantity': grocery.quantity,
                     'unit': grocery.unit,
                     'location': grocery.location,
-                    'purchase_date': grocery.purchase_date.isoformat() if grocery.purchase_date else None,
-                    'expiration_date': grocery.expiration_date.isoformat() if grocery.expiration_date else None,
-                    'opened_date': grocery.opened_date.isoformat() if grocery.opened_date else None,
+                    'purchase_date': grocery.purchase_date,
+                    'expiration_date': grocery.expiration_date,
+                    'opened_date': grocery.opened_date,
                     'is_opened': grocery.is_opened,
                     'is_expired': grocery.is_expired,
                     'notes': grocery.notes,
-                    'days_until_expiry': days_until_expiry,
-                    'expiry_status': expiry_status,
-                    'created_at': grocery.created_at.isoformat(),
-                    'updated_at': grocery.updated_at.isoformat()
+                    'days_until_expiry': grocery.days_until_expiry,
+                    'expiry_status': grocery.expiry_status,
+                    'created_at': grocery.created_at,
+                    'updated_at': grocery.updated_at
                 })
             
-            return jsonify({
+            body = orjson.dumps({
                 'groceries': result,
                 'total_items': len(result),
-                'expiring_soon': len([g for g in result if g['expiry_status'] == 'expiring_soon']),
-                'expired': len([g for g in result if g['expiry_status'] == 'expired'])
+                'expiring_soon': groceries[0].expiring_soon_count if groceries else 0,
+                'expired': groceries[0].expired_count if groceries else 0
             })
+            if GROCERIES_CACHE_TTL > 0:
+                if len(_groceries_cache) >= GROCERIES_CACHE_MAX:
+                    _groceries_cache.clear()
+                _groceries_cache[cache_key] = (body, now)
+            return Response(body, mimetype='application/json')
             
         finally:
             session.close()
@@ -131,43 +280,78 @@ def register_grocery_routes(app):
         data = request.get_json()
         user_id = data.get('user_id', 'demo_user')
         
-        # Required fields
-        food_type = data.get('food_type')  # 'usda' or 'custom'
-        quantity = data.get('quantity', 1.0)
-        unit = data.get('unit', 'unit')
+        # Reject bad requests before building the ORM object
+        try:
+            values = grocery_values(data, user_id)
+        except ValueError as e:
+            return _json({'error': str(e)}, 400)
         
         session = SessionLocal()
         try:
-            grocery = UserGrocery(
-                user_id=user_id,
-                quantity=quantity,
-                unit=unit,
-                location=data.get('location'),
-                purchase_date=datetime.fromisoformat(data['purchase_date']).date() if data.get('purchase_date') else None,
-                expiration_date=datetime.fromisoformat(data['expiration_date']).date() if data.get('expiration_date') else None,
-                is_opened=data.get('is_opened', False),
-                notes=data.get('notes')
-            )
-            
-            if food_type == 'usda':
-                grocery.food_item_id = data.get('food_item_id')
-            elif food_type == 'custom':
-                grocery.custom_food_id = data.get('custom_food_id')
-            else:
-                return jsonify({'error': 'food_type must be "usda" or "custom"'}), 400
+            grocery = UserGrocery(**values)
             
             session.add(grocery)
             session.commit()
+            invalidate_user_groceries(user_id)
             
-            return jsonify({
+            return _json({
                 'id': grocery.id,
                 'message': 'Grocery item added successfully',
-                'created_at': grocery.created_at.isoformat()
-            }), 201
+                'created_at': grocery.created_at
+            }, 201)
+            
+        except Exception as e:
+            session.rollback()
+            return _json({'error': f'Failed to add grocery item: {str(e)}'}, 500)
+        finally:
+            session.close()
+    
+    
+    @app.route('/api/groceries/bulk', methods=['POST'])
+    def add_grocery_items_bulk():
+        """Add many grocery items (e.g. an imported shopping list) in one request.
+
+        Body: {"user_id": ..., "items": [<same fields as POST /api/groceries>, ...]}. Every item
+        is validated first; the rows then go in as one multi-row INSERT ... RETURNING.
+        """
+        data = request.get_json()
+        user_id = data.get('user_id', 'demo_user')
+        items = data.get('items')
+        
+        if not isinstance(items, list) or not items:
+            return _json({'error': 'items must be a non-empty list'}, 400)
+        if len(items) > BULK_GROCERIES_MAX:
+            return _json({'error': f'At most {BULK_GROCERIES_MAX} items per request'}, 400)
+        
+        rows = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                return _json({'error': f'items[{index}] must be an object'}, 400)
+            try:
+                rows.append(grocery_values(item, user_id))
+            except ValueError as e:
+                return _json({'error': f'items[{index}]: {e}'}, 400)
+        
+        session = SessionLocal()
+        try:
+            created = session.execute(
+                insert(UserGrocery).returning(
+                    UserGrocery.id, UserGrocery.created_at, sort_by_parameter_order=True
+                ),
+                rows,
+            ).all()
+            session.commit()
+            invalidate_user_groceries(user_id)
+            
+            return _json({
+                'items': [{'id': grocery_id, 'created_at': created_at} for grocery_id, created_at in created],
+                'total_count': len(created),
+                'message': f'{len(created)} grocery items added successfully'
+            }, 201)
             
         except Exception as e:
             session.rollback()
-            return jsonify({'error': f'Failed to add grocery item: {str(e)}'}), 500
+            return _json({'error': f'Failed to add grocery items: {str(e)}'}, 500)
         finally:
             session.close()
     
@@ -180,44 +364,46 @@ def register_grocery_routes(app):
         
         session = SessionLocal()
         try:
-            grocery = session.query(UserGrocery).filter(
-                UserGrocery.id == grocery_id,
-                UserGrocery.user_id == user_id
-            ).first()
-            
-            if not grocery:
-                return jsonify({'error': 'Grocery item not found'}), 404
-            
-            # Update fields if provided
-            if 'quantity' in data:
-                grocery.quantity = data['quantity']
-            if 'unit' in data:
-                grocery.unit = data['unit']
-            if 'location' in data:
-                grocery.location = data['location']
+            # Collect only the fields provided
+            changes = {
+                field: data[field]
+                for field in ('quantity', 'unit', 'location', 'is_expired', 'notes')
+                if field in data
+            }
             if 'expiration_date' in data:
-                grocery.expiration_date = datetime.fromisoformat(data['expiration_date']).date() if data['expiration_date'] else None
+                changes['expiration_date'] = datetime.fromisoformat(data['expiration_date']).date() if data['expiration_date'] else None
             if 'is_opened' in data:
-                grocery.is_opened = data['is_opened']
-                if data['is_opened'] and not grocery.opened_date:
-                    grocery.opened_date = date.today()
-            if 'is_expired' in data:
-                grocery.is_expired = data['is_expired']
-            if 'notes' in data:
-                grocery.notes = data['notes']
-            
-            grocery.updated_at = datetime.utcnow()
+                changes['is_opened'] = data['is_opened']
+                if data['is_opened']:
+                    # Keep an existing opened_date; only stamp today when it was never set
+                    changes['opened_date'] = func.coalesce(UserGrocery.opened_date, date.today())
+            
+            # One UPDATE ... WHERE id AND owner RETURNING: no SELECT first, no ORM instance.
+            # updated_at is set by the column's onupdate (database clock)
+            row = session.execute(
+                update(UserGrocery)
+                .where(UserGrocery.id == grocery_id, UserGrocery.user_id == user_id)
+                .values(**changes)
+                .returning(UserGrocery.id, UserGrocery.updated_at)
+                .execution_options(synchronize_session=False)
+            ).one_or_none()
+            
+            if row is None:
+                session.rollback()
+                return _json({'error': 'Grocery item not found'}, 404)
+            
             session.commit()
+            invalidate_user_groceries(user_id)
             
-            return jsonify({
-                'id': grocery.id,
+            return _json({
+                'id': row.id,
                 'message': 'Grocery item updated successfully',
-                'updated_at': grocery.updated_at.isoformat()
+                'updated_at': row.updated_at
             })
             
         except Exception as e:
             session.rollback()
-            return jsonify({'error': f'Failed to update grocery item: {str(e)}'}), 500
+            return _json({'error': f'Failed to update grocery item: {str(e)}'}, 500)
         finally:
             session.close()
     
@@ -235,16 +421,17 @@ def register_grocery_routes(app):
             ).first()
             
             if not grocery:
-                return jsonify({'error': 'Grocery item not found'}), 404
+                return _json({'error': 'Grocery item not found'}, 404)
             
             session.delete(grocery)
             session.commit()
+            invalidate_user_groceries(user_id)
             
-            return jsonify({'message': 'Grocery item deleted successfully'})
+            return _json({'message': 'Grocery item deleted successfully'})
             
         except Exception as e:
             session.rollback()
-            return jsonify({'error': f'Failed to delete grocery item: {str(e)}'}), 500
+            return _json({'error': f'Failed to delete grocery item: {str(e)}'}, 500)
         finally:
             session.close()
     
@@ -262,7 +449,7 @@ def register_grocery_routes(app):
         try:
             custom_foods = session.query(CustomFood).filter(
                 or_(CustomFood.user_id == user_id, CustomFood.user_id.is_(None))
-            ).order_by(desc(CustomFood.created_at)).all()
+            ).options(undefer_group('details')).order_by(desc(CustomFood.created_at)).all()
             
             result = []
             for food in custom_foods:
@@ -283,11 +470,11 @@ def register_grocery_routes(app):
                     'nutrition_estimated': food.nutrition_estimated,
                     'estimated_confidence': food.estimated_confidence,
                     'user_id': food.user_id,
-                    'created_at': food.created_at.isoformat(),
-                    'updated_at': food.updated_at.isoformat()
+                    'created_at': food.created_at,
+                    'updated_at': food.updated_at
                 })
             
-            return jsonify({'custom_foods': result, 'total_count': len(result)})
+            return _json({'custom_foods': result, 'total_count': len(result)})
             
         finally:
             session.close()
@@ -320,16 +507,16 @@ def register_grocery_routes(app):
             session.add(custom_food)
             session.commit()
             
-            return jsonify({
+            return _json({
                 'id': custom_food.id,
                 'name': custom_food.name,
                 'message': 'Custom food created successfully',
-                'created_at': custom_food.created_at.isoformat()
-            }), 201
+                'created_at': custom_food.created_at
+            }, 201)
             
         except Exception as e:
             session.rollback()
-            return jsonify({'error': f'Failed to create custom food: {str(e)}'}), 500
+            return _json({'error': f'Failed to create custom food: {str(e)}'}, 500)
         finally:
             session.close()
     
@@ -344,78 +531,32 @@ def register_grocery_routes(app):
         serving_unit = data.get('serving_unit', 'serving')
         
         try:
-            # Import AI module
-            from mosaic_nutrition_ai import mosaic_nutrition_ai
+            if get_mosaic_nutrition_ai is None:
+                raise RuntimeError('AI nutrition module is not available')
             
-            # Create prompt for AI to estimate nutrition
-            prompt = f"""Please estimate the nutrition facts for this food item:
-            
-Name: {food_name}
-Description: {description}
-Serving size: {serving_size} {serving_unit}
-
-Please provide estimates for:
-- Calories
-- Protein (g)
-- Carbohydrates (g) 
-- Fat (g)
-- Fiber (g)
-- Sugar (g)
-
-Format your response as JSON with these exact keys: calories, protein_g, carbs_g, fat_g, fiber_g, sugar_g.
-Provide only reasonable estimates based on typical foods. If you're unsure, be conservative."""
-            
-            ai_response = mosaic_nutrition_ai.generate_nutrition_advice(prompt)
-            
-            # Try to extract JSON from response
-            import json
-            import re
-            
-            # Look for JSON-like content in the response
-            json_match = re.search(r'\{[^}]*\}', ai_response)
-            if json_match:
-                try:
-                    estimated_nutrition = json.loads(json_match.group())
-                    confidence = 0.7  # Medium confidence for AI estimates
-                except:
-                    estimated_nutrition = None
-                    confidence = 0.3
-            else:
-                estimated_nutrition = None
-                confidence = 0.3
+            # Concurrent estimate requests share one model call (see MosaicNutritionAI.estimate_nutrition)
+            estimated_nutrition = get_mosaic_nutrition_ai().estimate_nutrition(
+                food_name, description, serving_size, serving_unit
+            )
+            confidence = 0.7  # Medium confidence for AI estimates
             
             if not estimated_nutrition:
                 # Fallback estimates based on food type keywords
-                estimated_nutrition = {
-                    'calories': 200,
-                    'protein_g': 10,
-                    'carbs_g': 20,
-                    'fat_g': 8,
-                    'fiber_g': 3,
-                    'sugar_g': 5
-                }
+                estimated_nutrition = FALLBACK_NUTRITION
                 confidence = 0.4
             
-            return jsonify({
+            return _json({
                 'estimated_nutrition': estimated_nutrition,
                 'confidence': confidence,
-                'ai_response': ai_response,
                 'message': f'Nutrition estimated with {int(confidence*100)}% confidence'
             })
             
         except Exception as e:
-            return jsonify({
+            return _json({
                 'error': f'Failed to estimate nutrition: {str(e)}',
-                'fallback_nutrition': {
-                    'calories': 200,
-                    'protein_g': 10,
-                    'carbs_g': 20,
-                    'fat_g': 8,
-                    'fiber_g': 3,
-                    'sugar_g': 5
-                },
+                'fallback_nutrition': FALLBACK_NUTRITION,
                 'confidence': 0.3
-            }), 500
+            }, 500)
     
     
     # ============================================
@@ -430,27 +571,41 @@ Provide only reasonable estimates based on typical foods. If you're unsure, be c
         
         session = SessionLocal()
         try:
-            expiry_threshold = date.today() + timedelta(days=days_ahead)
-            
-            expiring_items = session.query(UserGrocery).filter(
+            today = date.today()
+            expiry_threshold = today + timedelta(days=days_ahead)
+            days_left = days_until(session, UserGrocery.expiration_date, today)
+            
+            # Day count and urgency come back from the database, so the row loop below only
+            # reshapes columns
+            expiring_items = session.query(
+                UserGrocery.id,
+                UserGrocery.quantity,
+                UserGrocery.unit,
+                UserGrocery.location,
+                UserGrocery.expiration_date,
+                days_left.label('days_until_expiry'),
+                urgency_case(days_left).label('urgency'),
+                FoodItem.name.label('food_name'),
+                CustomFood.name.label('custom_name'),
+            ).outerjoin(
+                FoodItem, UserGrocery.food_item_id == FoodItem.id
+            ).outerjoin(
+                CustomFood, UserGrocery.custom_food_id == CustomFood.id
+            ).filter(
                 UserGrocery.user_id == user_id,
                 UserGrocery.expiration_date.isnot(None),
                 UserGrocery.expiration_date <= expiry_threshold,
                 UserGrocery.is_expired == False
-            ).options(
-                joinedload(UserGrocery.food_item),
-                joinedload(UserGrocery.custom_food)
             ).order_by(UserGrocery.expiration_date.asc()).all()
             
             result = []
-            today = date.today()
             
             for item in expiring_items:
-                days_until_expiry = (item.expiration_date - today).days
-                urgency = "expired" if days_until_expiry < 0 else "critical" if days_until_expiry <= 1 else "warning"
+                days_until_expiry = item.days_until_expiry
+                urgency = item.urgency
                 
                 # Guard against rare bad rows with neither reference
-                if item.food_item is None and item.custom_food is None:
+                if item.food_name is None and item.custom_name is None:
                     # Skip or label unknown item to avoid 500s in production
                     result.append({
                         'id': item.id,
@@ -459,14 +614,14 @@ Provide only reasonable estimates based on typical foods. If you're unsure, be c
                         'quantity': item.quantity,
                         'unit': item.unit,
                         'location': item.location,
-                        'expiration_date': item.expiration_date.isoformat(),
+                        'expiration_date': item.expiration_date,
                         'days_until_expiry': days_until_expiry,
                         'urgency': urgency
                     })
                     continue
 
-                food_name = item.food_item.name if item.food_item else item.custom_food.name
-                food_type = 'usda' if item.food_item else 'custom'
+                food_name = item.food_name if item.food_name is not None else item.custom_name
+                food_type = 'usda' if item.food_name is not None else 'custom'
                 
                 result.append({
                     'id': item.id,
@@ -475,12 +630,12 @@ Provide only reasonable estimates based on typical foods. If you're unsure, be c
                     'quantity': item.quantity,
                     'unit': item.unit,
                     'location': item.location,
-                    'expiration_date': item.expiration_date.isoformat(),
+                    'expiration_date': item.expiration_date,
                     'days_until_expiry': days_until_expiry,
                     'urgency': urgency
                 })
             
-            return jsonify({
+            return _json({
                 'expiring_items': result,
                 'total_count': len(result),
                 'critical_count': len([i for i in result if i['urgency'] == 'critical']),
@@ -500,20 +655,26 @@ Provide only reasonable estimates based on typical foods. If you're unsure, be c
         
         session = SessionLocal()
         try:
-            updated_count = session.query(UserGrocery).filter(
-                UserGrocery.id.in_(grocery_ids),
-                UserGrocery.user_id == user_id
-            ).update({'is_expired': True, 'updated_at': datetime.utcnow()})
+            # Bulk UPDATE in IN-list chunks; nothing in this session holds the rows, so skip
+            # synchronizing the identity map
+            # updated_at is set by the column's onupdate (database clock)
+            updated_count = 0
+            for i in range(0, len(grocery_ids), MARK_EXPIRED_CHUNK):
+                updated_count += session.query(UserGrocery).filter(
+                    UserGrocery.id.in_(grocery_ids[i:i + MARK_EXPIRED_CHUNK]),
+                    UserGrocery.user_id == user_id
+                ).update({'is_expired': True}, synchronize_session=False)
             
             session.commit()
+            invalidate_user_groceries(user_id)
             
-            return jsonify({
+            return _json({
                 'message': f'Marked {updated_count} items as expired',
                 'updated_count': updated_count
             })
             
         except Exception as e:
             session.rollback()
-            return jsonify({'error': f'Failed to mark items as expired: {str(e)}'}), 500
+            return _json({'error': f'Failed to mark items as expired: {str(e)}'}, 500)
         finally:
             session.close()
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""
+Gunicorn settings for the Flask API (picked up from the working directory, or pass -c gunicorn.conf.py)
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+
+# A few processes, each with a thread pool for requests waiting on the model API or the DB.
+# Set WEB_CONCURRENCY to the instance's size: the default stays small because every worker holds
+# its own copy of the app (a 512MB instance fits only a couple), and the CPU count seen inside a
+# container is the host's, not the instance's.
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = 8
+
+# The GET /api/groceries response cache is per process and only invalidated by writes in its
+# own process; with several workers it would serve pre-write inventories, so turn it off
+if workers > 1:
+    os.environ.setdefault('GROCERIES_CACHE_TTL', '0')
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Workers inherit any engine the preloaded import created in the master. Drop those pools
+    # without closing their connections (the master still owns them), so each worker opens its own.
+    from db import engine
+    from usda_db import get_usda_engine
+
+    engine.dispose(close=False)
+    # The USDA engine is created lazily, so it only exists here if the master already used it
+    if get_usda_engine.cache_info().currsize:
+        get_usda_engine().dispose(close=False)
@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 import csv
+import io
+from datetime import datetime
 from pathlib import Path
-from typing import Optional
 
+import pandas as pd
 from dateutil import parser as dateparser
+from sqlalchemy import insert, select, text
 from sqlalchemy.orm import Session
 
 # Support both package and script execution
@@ -21,13 +24,76 @@ except ImportError:  # running as a script
 SAMPLE_CSV = Path(__file__).resolve().parents[1].with_name('data') / 'samples' / 'foods.csv'
 
 
-def to_float(x: Optional[str]) -> Optional[float]:
-    if x is None or x == "":
-        return None
+FOOD_COLUMNS = ['name', 'brand', 'category', 'upc']
+NUMERIC_COLUMNS = [
+    'serving_size', 'calories', 'protein_g', 'carbs_g', 'fat_g', 'fiber_g', 'sugar_g', 'sodium_mg',
+]
+PERISHABLE_TRUE = {'1', 'true', 'yes', 'y'}
+
+
+BATCH_SIZE = 1000
+# Below this many rows the two extra COPY round trips cost more than executemany saves
+COPY_MIN_ROWS = 100
+
+
+def bulk_load_food_items(session: Session, food_rows: list[dict], nutrition_rows: list[dict]) -> None:
+    """Insert FoodItems and their NutritionFacts (nutrition_rows[i] belongs to food_rows[i]).
+
+    Uses COPY on PostgreSQL for batches of COPY_MIN_ROWS or more, otherwise executemany
+    INSERT ... RETURNING. Nothing is committed; the caller owns the transaction.
+    """
+    if session.get_bind().dialect.name == 'postgresql' and len(food_rows) >= COPY_MIN_ROWS:
+        _copy_batch(session, food_rows, nutrition_rows)
+        return
+    ids = session.scalars(
+        insert(FoodItem).returning(FoodItem.id, sort_by_parameter_order=True), food_rows
+    ).all()
+    for food_item_id, facts in zip(ids, nutrition_rows):
+        facts['food_item_id'] = food_item_id
+    session.execute(insert(NutritionFacts), nutrition_rows)
+
+
+FOOD_COPY_COLUMNS = ['id', 'name', 'brand', 'category', 'upc', 'is_perishable', 'created_at']
+NUTRITION_COPY_COLUMNS = [
+    'food_item_id', 'serving_size', 'serving_unit', 'calories', 'protein_g', 'carbs_g',
+    'fat_g', 'fiber_g', 'sugar_g', 'sodium_mg',
+]
+
+
+def _copy_rows(cursor, table: str, columns: list[str], rows: list[tuple]) -> None:
+    """COPY rows into table as CSV (None is written as an unquoted empty field, i.e. NULL)."""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def _copy_batch(session: Session, food_rows: list[dict], nutrition_rows: list[dict]) -> None:
+    """PostgreSQL path for bulk_load_food_items: two COPY streams instead of executemany.
+
+    FoodItem ids are drawn from the table's sequence up front so the NutritionFacts rows can
+    reference them without reading anything back. Runs on the session's connection, so it is
+    committed (or rolled back) with the rest of the import.
+    """
+    conn = session.connection()
+    ids = conn.execute(
+        text("SELECT nextval(pg_get_serial_sequence('food_items', 'id')) FROM generate_series(1, :n)"),
+        {'n': len(food_rows)},
+    ).scalars().all()
+    now = datetime.utcnow()
+    cursor = conn.connection.cursor()
     try:
-        return float(x)
-    except ValueError:
-        return None
+        _copy_rows(cursor, 'food_items', FOOD_COPY_COLUMNS, [
+            (food_item_id, row['name'], row['brand'], row['category'], row['upc'],
+             'true' if row['is_perishable'] else 'false', now)
+            for food_item_id, row in zip(ids, food_rows)
+        ])
+        _copy_rows(cursor, 'nutrition_facts', NUTRITION_COPY_COLUMNS, [
+            (food_item_id, *(facts[column] for column in NUTRITION_COPY_COLUMNS[1:]))
+            for food_item_id, facts in zip(ids, nutrition_rows)
+        ])
+    finally:
+        cursor.close()
 
 
 def main(csv_path: Path = SAMPLE_CSV):
@@ -38,57 +104,74 @@ def main(csv_path: Path = SAMPLE_CSV):
     session: Session = SessionLocal()
     inserted = 0
     skipped = 0
+    food_rows: list[dict] = []
+    nutrition_rows: list[dict] = []
 
     try:
-        with csv_path.open(newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                name = row.get('name')
-                if not name:
-                    skipped += 1
-                    continue
-                brand = row.get('brand') or None
-                category = row.get('category') or None
-                upc = row.get('upc') or None
-                is_perishable = (row.get('is_perishable') or 'true').strip().lower() in {'1', 'true', 'yes', 'y'}
-
-                # Deduplicate by name+brand+upc
-                existing = (
-                    session.query(FoodItem)
-                    .filter(FoodItem.name == name)
-                    .filter(FoodItem.brand == brand)
-                    .filter(FoodItem.upc == upc)
-                    .first()
-                )
-                if existing:
+        # One SELECT of every existing name/brand/upc key; membership is then O(1) per row
+        existing_keys = set(
+            session.execute(select(FoodItem.name, FoodItem.brand, FoodItem.upc)).tuples()
+        )
+
+        # Parsed in BATCH_SIZE chunks by pandas' C reader. Everything is read as text with only
+        # empty cells treated as missing; numeric columns are then converted per column, with
+        # unparseable values becoming None (as the old per-cell float() fallback did)
+        chunks = pd.read_csv(
+            csv_path,
+            dtype=str,
+            keep_default_na=False,
+            na_values=[''],
+            encoding='utf-8',
+            chunksize=BATCH_SIZE,
+        )
+        for chunk in chunks:
+            chunk = chunk.reindex(columns=FOOD_COLUMNS + ['is_perishable', 'serving_unit'] + NUMERIC_COLUMNS)
+            named = chunk['name'].notna()
+            skipped += int((~named).sum())
+            chunk = chunk[named].copy()
+            for column in NUMERIC_COLUMNS:
+                chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+            chunk['is_perishable'] = (
+                chunk['is_perishable'].fillna('true').str.strip().str.lower().isin(PERISHABLE_TRUE)
+            )
+            # NaN/NA -> None so the rows bind as SQL NULLs
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+
+            for row in chunk.to_dict(orient='records'):
+                # Deduplicate by name+brand+upc (already stored, or earlier in this file)
+                key = (row['name'], row['brand'], row['upc'])
+                if key in existing_keys:
                     skipped += 1
                     continue
-
-                item = FoodItem(
-                    name=name,
-                    brand=brand,
-                    category=category,
-                    upc=upc,
-                    is_perishable=is_perishable,
-                )
-                session.add(item)
-                session.flush()  # To get item.id
-
-                facts = NutritionFacts(
-                    food_item_id=item.id,
-                    serving_size=to_float(row.get('serving_size')),
-                    serving_unit=row.get('serving_unit') or None,
-                    calories=to_float(row.get('calories')),
-                    protein_g=to_float(row.get('protein_g')),
-                    carbs_g=to_float(row.get('carbs_g')),
-                    fat_g=to_float(row.get('fat_g')),
-                    fiber_g=to_float(row.get('fiber_g')),
-                    sugar_g=to_float(row.get('sugar_g')),
-                    sodium_mg=to_float(row.get('sodium_mg')),
-                )
-                session.add(facts)
+                existing_keys.add(key)
+
+                food_rows.append({
+                    'name': row['name'],
+                    'brand': row['brand'],
+                    'category': row['category'],
+                    'upc': row['upc'],
+                    'is_perishable': row['is_perishable'],
+                })
+                nutrition_rows.append({
+                    'serving_size': row['serving_size'],
+                    'serving_unit': row['serving_unit'],
+                    'calories': row['calories'],
+                    'protein_g': row['protein_g'],
+                    'carbs_g': row['carbs_g'],
+                    'fat_g': row['fat_g'],
+                    'fiber_g': row['fiber_g'],
+                    'sugar_g': row['sugar_g'],
+                    'sodium_mg': row['sodium_mg'],
+                })
                 inserted += 1
 
+                if len(food_rows) >= BATCH_SIZE:
+                    bulk_load_food_items(session, food_rows, nutrition_rows)
+                    food_rows, nutrition_rows = [], []
+
+        if food_rows:
+            bulk_load_food_items(session, food_rows, nutrition_rows)
+
         session.commit()
         print(f"Inserted {inserted} items; skipped {skipped}")
     except Exception:
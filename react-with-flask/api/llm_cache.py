@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+
+def get_llm_cache_path() -> Path:
+    # Allow overriding the cache location from an environment variable.
+    # Example: export LLM_CACHE_PATH="/tmp/llm_cache.sqlite3"
+    env_path = os.getenv("LLM_CACHE_PATH")
+    if env_path:
+        return Path(env_path).expanduser().resolve()
+
+    # Next to the app database: react-with-flask/api -> 2025_hackgt/data
+    return Path(__file__).resolve().parents[2] / "data" / "llm_cache.sqlite3"
+
+
+LLM_CACHE_PATH = get_llm_cache_path()
+_local = threading.local()
+
+
+def _connection() -> sqlite3.Connection:
+    """This thread's connection to the cache file (created with its table on first use)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        LLM_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(LLM_CACHE_PATH, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)"
+        )
+        _local.conn = conn
+    return conn
+
+
+def completion_key(params: dict) -> str:
+    """SHA-256 of the full chat.completions.create arguments (model, messages, sampling)."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def estimate_key(name: str, description: str, serving_size, serving_unit: str) -> str:
+    """Key for a custom-food nutrition estimate: BLAKE2b of the normalized food fields.
+
+    Independent of how the request was batched or prompted, so the same food is only ever
+    estimated once.
+    """
+    normalized = [(name or "").lower().strip(), (description or "").lower().strip(), serving_size, serving_unit]
+    return "est:" + hashlib.blake2b(json.dumps(normalized).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_response(key: str) -> Optional[str]:
+    # A cache failure must never fail the answer: treat it as a miss
+    try:
+        row = _connection().execute(
+            "SELECT response FROM llm_responses WHERE key = ?", (key,)
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Warning: LLM cache read failed: {e}")
+        return None
+    return row[0] if row else None
+
+
+def put_response(key: str, response: str) -> None:
+    try:
+        _connection().execute(
+            "INSERT OR REPLACE INTO llm_responses (key, response) VALUES (?, ?)", (key, response)
+        )
+    except sqlite3.Error as e:
+        print(f"Warning: LLM cache write failed: {e}")
@@ -12,11 +12,17 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
+    JSON,
     String,
     UniqueConstraint,
+    text,
 )
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql.expression import FunctionElement
 
 # Support both package and script execution
 try:
@@ -27,25 +33,60 @@ except ImportError:  # running as a script
     from db import Base
 
 
+class utcnow(FunctionElement):
+    """Current UTC time as a naive timestamp, evaluated by the database.
+
+    Used for created_at/updated_at so the timestamp is rendered inline in the INSERT/UPDATE
+    (no Python clock call, no bound parameter per row) and matches the UTC values stored by
+    earlier datetime.utcnow defaults.
+    """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw):
+    # Postgres' CURRENT_TIMESTAMP is timestamptz; store it as UTC wall time
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
 class FoodItem(Base):
     __tablename__ = "food_items"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    name: Mapped[str] = mapped_column(String(255), index=True)
+    # name lookups use uq_food_name_brand_upc's leading column; upc has a partial index below
+    name: Mapped[str] = mapped_column(String(255))
     brand: Mapped[Optional[str]] = mapped_column(String(255), nullable=True, index=True)
     category: Mapped[Optional[str]] = mapped_column(String(128), nullable=True, index=True)
-    upc: Mapped[Optional[str]] = mapped_column(String(32), nullable=True, unique=False, index=True)
+    upc: Mapped[Optional[str]] = mapped_column(String(32), nullable=True, unique=False)
+    # FoodData Central id for items imported from USDA (unique index: O(log N) lookup on re-import)
+    fdc_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, unique=True, index=True)
     is_perishable: Mapped[bool] = mapped_column(Boolean, default=True, server_default="1")
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # deferred=True: left out of entity SELECTs and loaded on first access. Used for columns the
+    # list/search/display paths never read; endpoints that do return them undefer them
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), server_default=utcnow(), deferred=True)
 
+    # lazy="raise_on_sql": callers must eager-load (joinedload/selectinload/contains_eager);
+    # an accidental per-row lazy load raises instead of silently issuing N extra SELECTs
     nutrition: Mapped["NutritionFacts"] = relationship(
-        back_populates="food_item", uselist=False, cascade="all, delete-orphan"
+        back_populates="food_item", uselist=False, cascade="all, delete-orphan", lazy="raise_on_sql"
     )
     inventory_items: Mapped[list["InventoryItem"]] = relationship(back_populates="food_item")
 
     __table_args__ = (
         # Avoid exact duplicates of the same item/brand/upc
         UniqueConstraint("name", "brand", "upc", name="uq_food_name_brand_upc"),
+        # Most items have no UPC; only index the ones that do
+        Index(
+            "ix_food_items_upc_notnull", "upc",
+            postgresql_where=text("upc IS NOT NULL"), sqlite_where=text("upc IS NOT NULL"),
+        ),
     )
 
 
@@ -81,7 +122,7 @@ class InventoryItem(Base):
     expiry_date: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
     opened_at: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
 
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), server_default=utcnow())
 
     # Optional: track a household/user later
     household_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
@@ -99,7 +140,8 @@ class CustomFood(Base):
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(255), index=True)
-    description: Mapped[Optional[str]] = mapped_column(String(1000), nullable=True)
+    # Deferred (see FoodItem.created_at); GET /api/custom-foods undefers the "details" group
+    description: Mapped[Optional[str]] = mapped_column(String(1000), nullable=True, deferred=True, deferred_group="details")
     
     # Nutrition info (user provided or AI estimated)
     serving_size: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
@@ -119,8 +161,8 @@ class CustomFood(Base):
     # User/household association
     user_id: Mapped[Optional[str]] = mapped_column(String(128), nullable=True, index=True)
     
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), server_default=utcnow(), deferred=True, deferred_group="details")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow(), deferred=True, deferred_group="details")
     
     # Relationships
     grocery_items: Mapped[list["UserGrocery"]] = relationship(back_populates="custom_food")
@@ -137,7 +179,8 @@ class UserGrocery(Base):
     custom_food_id: Mapped[Optional[int]] = mapped_column(ForeignKey("custom_foods.id", ondelete="CASCADE"), nullable=True, index=True)
     
     # User/household identification
-    user_id: Mapped[str] = mapped_column(String(128), index=True)  # Required for grocery tracking
+    # Required for grocery tracking; indexed as the leading column of ix_usergrocery_user_exp
+    user_id: Mapped[str] = mapped_column(String(128))
     
     # Quantity and location info
     quantity: Mapped[float] = mapped_column(Float, default=1.0)
@@ -146,20 +189,20 @@ class UserGrocery(Base):
     
     # Date tracking
     purchase_date: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
-    expiration_date: Mapped[Optional[date]] = mapped_column(Date, nullable=True, index=True)
+    expiration_date: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
     opened_date: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
     
     # Status tracking
     is_opened: Mapped[bool] = mapped_column(Boolean, default=False)
     is_expired: Mapped[bool] = mapped_column(Boolean, default=False)
-    notes: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    notes: Mapped[Optional[str]] = mapped_column(String(500), nullable=True, deferred=True)  # grocery list selects it explicitly
     
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), server_default=utcnow())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow())
     
-    # Relationships
-    food_item: Mapped[Optional[FoodItem]] = relationship()
-    custom_food: Mapped[Optional[CustomFood]] = relationship(back_populates="grocery_items")
+    # Relationships (lazy="raise_on_sql", see FoodItem.nutrition)
+    food_item: Mapped[Optional[FoodItem]] = relationship(lazy="raise_on_sql")
+    custom_food: Mapped[Optional[CustomFood]] = relationship(back_populates="grocery_items", lazy="raise_on_sql")
     
     __table_args__ = (
         CheckConstraint("quantity >= 0", name="ck_grocery_quantity_nonnegative"),
@@ -168,6 +211,9 @@ class UserGrocery(Base):
             "(food_item_id IS NOT NULL AND custom_food_id IS NULL) OR (food_item_id IS NULL AND custom_food_id IS NOT NULL)", 
             name="ck_food_reference"
         ),
+        # Grocery list/expiring/fridge queries filter on user_id and range/ORDER BY expiration_date
+        # in one index scan; the is_expired filter is applied to the rows it returns
+        Index("ix_usergrocery_user_exp", "user_id", "expiration_date"),
     )
 
 
@@ -176,19 +222,25 @@ class UserFavorite(Base):
     __tablename__ = "user_favorites"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    user_id: Mapped[str] = mapped_column(String(128), index=True)
+    # Indexed as the leading column of ix_uf_user_created (and the unique constraints)
+    user_id: Mapped[str] = mapped_column(String(128))
 
     # Reference either USDA food item OR custom food (one-of)
     food_item_id: Mapped[Optional[int]] = mapped_column(ForeignKey("food_items.id", ondelete="CASCADE"), nullable=True, index=True)
     custom_food_id: Mapped[Optional[int]] = mapped_column(ForeignKey("custom_foods.id", ondelete="CASCADE"), nullable=True, index=True)
 
     display_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
-    notes: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    notes: Mapped[Optional[str]] = mapped_column(String(500), nullable=True, deferred=True)
+    # Snapshot of the referenced food's name/brand/category (USDA) or name/description (custom),
+    # written at POST time so list_favorites reads one table with no joins
+    food_info: Mapped[Optional[dict]] = mapped_column(
+        JSON().with_variant(JSONB(), "postgresql"), nullable=True, deferred=True
+    )
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), server_default=utcnow())
 
-    # Relationships
-    food_item: Mapped[Optional[FoodItem]] = relationship()
-    custom_food: Mapped[Optional[CustomFood]] = relationship()
+    # Relationships (lazy="raise_on_sql", see FoodItem.nutrition)
+    food_item: Mapped[Optional[FoodItem]] = relationship(lazy="raise_on_sql")
+    custom_food: Mapped[Optional[CustomFood]] = relationship(lazy="raise_on_sql")
 
     __table_args__ = (
         # Enforce one-of semantics
@@ -199,4 +251,6 @@ class UserFavorite(Base):
         # Prevent duplicates per user per referenced item
         UniqueConstraint("user_id", "food_item_id", name="uq_fav_user_fooditem"),
         UniqueConstraint("user_id", "custom_food_id", name="uq_fav_user_customfood"),
+        # list_favorites: WHERE user_id = ? ORDER BY created_at DESC straight off the index
+        Index("ix_uf_user_created", "user_id", text("created_at DESC")),
     )
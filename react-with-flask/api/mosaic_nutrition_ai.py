@@ -3,25 +3,349 @@ Mosaic AI Model Serving - Nutrition AI Assistant
 Uses Databricks Mosaic AI Model Serving with OpenAI GPT as external model
 Qualifies for Databricks Open Source prize by using Databricks infrastructure
 """
+import atexit
+import logging
 import os
 from dotenv import load_dotenv, find_dotenv
 import json
 import os
-from typing import Dict, List, Optional
-from openai import OpenAI
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date
+from functools import lru_cache
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from openai import DefaultHttpxClient, OpenAI
+from sqlalchemy import func, select
 
 # Load .env from parent/project root if needed and override stale env vars
 load_dotenv(find_dotenv(), override=True)
 
 # Import USDA queries directly to avoid circular dependency
 try:
-    from .usda_db import USDA_ENGINE
-    from .usda_queries import search_usda, get_basic_nutrients
+    from . import llm_cache
+    from .db import SessionLocal
+    from .models import CustomFood, FoodItem, UserGrocery
+    from .usda_db import get_usda_engine, usda_available
+    from .usda_queries import search_usda_distinct, get_basic_nutrients_bulk
 except ImportError:  # Running as a script
     import sys
     sys.path.append(os.path.dirname(__file__))
-    from usda_db import USDA_ENGINE
-    from usda_queries import search_usda, get_basic_nutrients
+    import llm_cache
+    from db import SessionLocal
+    from models import CustomFood, FoodItem, UserGrocery
+    from usda_db import get_usda_engine, usda_available
+    from usda_queries import search_usda_distinct, get_basic_nutrients_bulk
+
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs httpx's optional h2 package; with it, concurrent (streamed) completions are
+# multiplexed over one TLS connection instead of each holding its own
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+# One OpenAI client per process: its pooled keep-alive HTTP connections are shared by every
+# caller instead of each new client paying its own connection/TLS setup
+_openai_client: Optional[OpenAI] = None
+
+# Cap on model calls in flight across all request threads, so a traffic spike queues here
+# instead of turning into a burst of 429s. Rate-limited and timed-out calls that do happen are
+# retried by the SDK itself (exponential backoff with jitter, honouring Retry-After).
+OPENAI_MAX_CONCURRENCY = 8
+OPENAI_MAX_RETRIES = 5
+_openai_slots = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+
+
+def get_openai_client() -> OpenAI:
+    """Process-wide OpenAI client, created on first use."""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = OpenAI(
+            api_key=os.getenv("OPENAI_KEY"),
+            timeout=30.0,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=DefaultHttpxClient(http2=_HTTP2),
+        )
+        atexit.register(_openai_client.close)
+    return _openai_client
+
+
+# Constant prompt/message text, built once at import rather than on every call
+NUTRITION_SYSTEM_PROMPT = """You are a professional nutrition expert and registered dietitian. 
+You provide accurate, science-based nutrition advice using real USDA food data.
+
+Key guidelines:
+- Always use the provided USDA nutrition data when available
+- Provide specific numbers and percentages 
+- Give practical, actionable advice
+- Mention serving sizes and daily value context
+- Be encouraging and supportive
+- If asked about medical conditions, recommend consulting healthcare providers
+
+Response format (required):
+1) Title (if applicable)
+2) Ingredients or key items (when relevant)
+3) Steps or guidance (numbered, concise)
+4) Macros per serving (required)
+   - Calories: <number> kcal
+   - Protein: <number> g
+   - Carbs: <number> g
+   - Fat: <number> g
+
+Rules for macros:
+- If USDA data is provided, base macros on it. Otherwise, provide best-effort estimates and note they are approximate.
+- Keep units consistent (kcal, g).
+- At the very end, include a single-line JSON object inside these tags for parsing by the app:
+  <MACROS_JSON>{"macros_per_serving": {"calories": <number>, "protein_g": <number>, "carbs_g": <number>, "fat_g": <number>}, "confidence": <0-1> }</MACROS_JSON>
+
+Focus on being helpful, accurate, and educational."""
+
+RECIPE_SYSTEM_PROMPT = """You are a creative chef and nutrition expert who specializes in helping people use their existing groceries efficiently.
+        
+Key guidelines:
+- PRIORITIZE ingredients that are expiring soon (1–3 days) to reduce food waste
+- Suggest recipes that use multiple items from their inventory
+- Provide specific, actionable recipe suggestions with steps
+- Include approximate cooking times and difficulty levels
+- If they have expiring items, emphasize using those first
+- Be creative but practical with ingredient substitutions
+- Include nutritional benefits when relevant
+- NO introductions, preambles, or chatty phrases at the beginning - start directly with the recipe content
+- Keep the title and serving information prominent at the top
+- A pleasant sign-off at the end is acceptable
+
+STRICT Response format (follow exactly):
+
+[Recipe Title]
+Servings: X | Total Time: X minutes
+
+Ingredients
+- [natural quantities: "1 chicken breast", "2 cups milk", never "1.0 items"]
+- [only use units that make sense: oz/ml for liquids, cups for measured items]
+
+Steps
+1. [Clear cooking instruction]
+2. [Next cooking instruction]
+
+Macros per serving
+- Calories: [number] kcal
+- Protein: [number] g
+- Carbs: [number] g  
+- Fat: [number] g
+
+IMPORTANT: Follow this format exactly every time. Do not deviate.
+IMPORTANT: NO labels before the title - start directly with the recipe name (not "Title:" or "Recipe:").
+IMPORTANT: Do not put the title in brackets - just write the recipe name directly.
+
+Rules for macros:
+- If USDA data is provided, base macros on it. Otherwise, provide best-effort estimates and note they are approximate.
+- Keep units consistent (kcal, g).
+- At the very end, include a single-line JSON object inside these tags for parsing by the app:
+  <MACROS_JSON>{"macros_per_serving": {"calories": <number>, "protein_g": <number>, "carbs_g": <number>, "fat_g": <number>}, "confidence": <0-1> }</MACROS_JSON>
+
+Respond with enthusiasm and practical cooking advice!"""
+
+# Shown by _fallback_response when there is no nutrition context to report
+WELCOME_MESSAGE = """👋 I'm your AI nutrition assistant powered by Mosaic AI Model Serving!
+
+I can help you with:
+• Food nutrition facts and macro breakdowns
+• Weight management guidance  
+• Muscle building nutrition advice
+• General healthy eating tips
+
+Try asking me about specific foods like:
+• "What are the macros for chicken breast?"
+• "Is avocado good for weight loss?"
+• "How much protein should I eat?"
+
+I use real USDA nutrition data to give you accurate information! 🎯"""
+
+
+# MACROS_JSON block the system prompt asks for, and a bare trailing object as a fallback
+_MACROS_TAG_RE = re.compile(r"<MACROS_JSON>\s*(\{.*?\})\s*</MACROS_JSON>", re.DOTALL)
+_MACROS_FALLBACK_RE = re.compile(r"(\{\s*\"macros_per_serving\".*\})", re.DOTALL)
+
+
+# Model answers to recently asked questions, keyed by the normalized message ("How much protein
+# should I eat?" == "how much protein should i eat"). The USDA context is derived from the message
+# alone, so the same key always produced the same prompt. Fallback answers are never stored.
+ADVICE_CACHE_SIZE = 256
+_advice_cache: "OrderedDict[str, str]" = OrderedDict()
+_advice_cache_lock = threading.Lock()
+_MESSAGE_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def _advice_key(user_message: str) -> str:
+    return ' '.join(_MESSAGE_TOKEN_RE.findall(user_message.lower()))
+
+
+def _cached_advice(key: str) -> Optional[str]:
+    with _advice_cache_lock:
+        answer = _advice_cache.get(key)
+        if answer is not None:
+            _advice_cache.move_to_end(key)
+        return answer
+
+
+def _store_advice(key: str, answer: str) -> None:
+    with _advice_cache_lock:
+        _advice_cache[key] = answer
+        _advice_cache.move_to_end(key)
+        if len(_advice_cache) > ADVICE_CACHE_SIZE:
+            _advice_cache.popitem(last=False)
+
+
+# Runs the independent per-food USDA lookups of one advice request side by side
+_LOOKUP_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="usda-lookup")
+
+
+# Custom-food nutrition estimates: requests arriving within ESTIMATE_BATCH_WINDOW seconds of the
+# first one share a single model call (up to ESTIMATE_BATCH_MAX foods in one prompt)
+ESTIMATE_BATCH_WINDOW = 0.05
+ESTIMATE_BATCH_MAX = 16
+ESTIMATE_KEYS = ('calories', 'protein_g', 'carbs_g', 'fat_g', 'fiber_g', 'sugar_g')
+
+
+class _EstimateBatcher:
+    """Tumbling-window coalescer for MosaicNutritionAI.estimate_nutrition.
+    
+    Callers block on a Future while a background thread gathers the window's requests and
+    hands each batch to a worker pool, so a slow model call never holds up the next window.
+    """
+    
+    def __init__(self):
+        self._queue: "queue.Queue[tuple[dict, Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pool = ThreadPoolExecutor(
+            max_workers=OPENAI_MAX_CONCURRENCY, thread_name_prefix="estimate-batch"
+        )
+    
+    def submit(self, item: dict) -> Future:
+        future: Future = Future()
+        self._queue.put((item, future))
+        # Started on first use, so it runs in the process (gunicorn worker) that needs it
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, name="estimate-batcher", daemon=True)
+                self._thread.start()
+        return future
+    
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + ESTIMATE_BATCH_WINDOW
+            while len(batch) < ESTIMATE_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._pool.submit(self._run, batch)
+    
+    @staticmethod
+    def _run(batch):
+        try:
+            results = get_mosaic_nutrition_ai()._estimate_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+_estimate_batcher = _EstimateBatcher()
+
+
+# Common food keywords for extraction, in lookup priority order
+FOOD_KEYWORDS = (
+    'chicken', 'beef', 'pork', 'fish', 'salmon', 'tuna', 'turkey',
+    'egg', 'eggs', 'milk', 'cheese', 'yogurt', 'butter',
+    'rice', 'bread', 'pasta', 'oats', 'oatmeal', 'quinoa',
+    'apple', 'banana', 'orange', 'berries', 'avocado', 'spinach',
+    'broccoli', 'carrots', 'potato', 'sweet potato',
+    'beans', 'lentils', 'nuts', 'almonds', 'peanuts',
+)
+# All keywords as one compiled alternation, matched in a single pass over the message. Keywords
+# must start a word ("rice" not in "price", "oats" not in "goats") but may continue into one
+# ("apples", "chickens"). The zero-width lookahead tries every word start (so "sweet potato" and
+# "potato" are both found) and takes the longest keyword there; shorter keywords that are its
+# prefixes ("egg" in "eggs") are implied via _KEYWORD_PREFIX_BITS.
+_FOOD_KEYWORD_RE = re.compile(
+    r'(?=\b(' + '|'.join(re.escape(k) for k in sorted(FOOD_KEYWORDS, key=len, reverse=True)) + '))'
+)
+# Matches accumulate into an int bitmask with bit i = FOOD_KEYWORDS[i]: repeats dedupe for free
+# and reading the set bits from the lowest up yields keywords already in priority order
+_KEYWORD_PREFIX_BITS = {
+    k: sum(1 << i for i, p in enumerate(FOOD_KEYWORDS) if k.startswith(p)) for k in FOOD_KEYWORDS
+}
+
+
+class FoodResult(NamedTuple):
+    """One USDA search hit with its basic nutrients (per 100g; None when not recorded).
+    
+    Immutable, so cached results can be handed to every caller without copying.
+    """
+    fdc_id: Optional[int]
+    description: str
+    data_type: str
+    calories: Optional[float]
+    protein_g: Optional[float]
+    carbs_g: Optional[float]
+    fat_g: Optional[float]
+    fiber_g: Optional[float]
+    sugar_g: Optional[float]
+
+
+# The USDA database is read-only, so search results for a (lowercased) query are reused across
+# requests; common foods skip both the search and the per-result nutrient queries. Errors
+# propagate instead of being cached.
+@lru_cache(maxsize=1024)
+def _search_food_nutrition_cached(food_query: str, limit: int) -> tuple:
+    # Best-ranked row per distinct description, deduplicated by the database
+    engine = get_usda_engine()
+    kept = search_usda_distinct(engine, food_query, limit)
+    
+    # Nutritional data for all kept results in one IN (...) query
+    nutrition_map = get_basic_nutrients_bulk(
+        engine, [result['fdc_id'] for result in kept if result.get('fdc_id')]
+    )
+    
+    enhanced_results = []
+    for result in kept:
+        fdc_id = result.get('fdc_id')
+        nutrition = nutrition_map.get(fdc_id, {})
+        enhanced_results.append(FoodResult(
+            fdc_id,
+            result.get('description', ''),
+            result.get('data_type', ''),
+            nutrition.get('calories'),
+            nutrition.get('protein_g'),
+            nutrition.get('carbs_g'),
+            nutrition.get('fat_g'),
+            nutrition.get('fiber_g'),
+            nutrition.get('sugar_g'),
+        ))
+    
+    return tuple(enhanced_results)
+
+
+def clear_nutrition_caches() -> None:
+    """Drop cached USDA searches and model answers; call after the USDA database is rebuilt."""
+    _search_food_nutrition_cached.cache_clear()
+    with _advice_cache_lock:
+        _advice_cache.clear()
 
 
 class MosaicNutritionAI:
@@ -34,11 +358,8 @@ class MosaicNutritionAI:
     
     def _setup_clients(self):
         """Setup OpenAI client for external model serving through Mosaic AI"""
-        # Use the working API key from our tests
-        api_key = os.getenv("OPENAI_KEY")
-        
         try:
-            self.openai_client = OpenAI(api_key=api_key, timeout=30.0)
+            self.openai_client = get_openai_client()
             print("✅ Mosaic AI Model Serving with OpenAI external model ready!")
             self.ready = True
         except Exception as e:
@@ -46,119 +367,106 @@ class MosaicNutritionAI:
             self.openai_client = None
             self.ready = False
     
-    def search_food_nutrition(self, food_query: str, limit: int = 3) -> List[Dict]:
+    def search_food_nutrition(self, food_query: str, limit: int = 3) -> List[FoodResult]:
         """Search for food nutrition data directly from USDA database"""
         try:
-            if USDA_ENGINE is None:
+            if not usda_available():
                 print("Warning: USDA database not available")
                 return []
             
-            # Get search results from USDA database
-            raw_results = search_usda(USDA_ENGINE, food_query, limit * 2)  # Get more to filter
-            
-            # Filter and enhance results with nutrition data
-            enhanced_results = []
-            seen_descriptions = set()
-            
-            for result in raw_results:
-                description = result.get('description', '')
-                fdc_id = result.get('fdc_id')
-                
-                # Skip duplicates
-                if description in seen_descriptions:
-                    continue
-                
-                # Get nutritional data
-                nutrition = get_basic_nutrients(USDA_ENGINE, fdc_id) if fdc_id else {}
-                
-                enhanced_result = {
-                    'fdc_id': fdc_id,
-                    'description': description,
-                    'data_type': result.get('data_type', ''),
-                    'nutrition': {
-                        'calories': nutrition.get('calories'),
-                        'protein_g': nutrition.get('protein_g'), 
-                        'carbs_g': nutrition.get('carbs_g'),
-                        'fat_g': nutrition.get('fat_g'),
-                        'fiber_g': nutrition.get('fiber_g'),
-                        'sugar_g': nutrition.get('sugar_g')
-                    }
-                }
-                
-                enhanced_results.append(enhanced_result)
-                seen_descriptions.add(description)
-                
-                if len(enhanced_results) >= limit:
-                    break
-            
-            return enhanced_results
+            return list(_search_food_nutrition_cached(food_query.lower(), limit))
             
         except Exception as e:
             print(f"Error searching food data: {e}")
             return []
     
-    def generate_nutrition_advice(self, user_message: str) -> str:
-        """Generate AI nutrition advice using Mosaic AI Model Serving"""
+    def generate_nutrition_advice(self, user_message: str, force_refresh: bool = False) -> str:
+        """Generate AI nutrition advice using Mosaic AI Model Serving.
         
-        # Extract food items and get real nutrition data
-        foods_mentioned = self._extract_food_items(user_message)
-        nutrition_context = ""
+        force_refresh skips the cached answers and always asks the model (e.g. a user retry).
+        """
+        # Repeated question: reuse the earlier answer (no USDA lookups, no model call)
+        cached = None if force_refresh else _cached_advice(_advice_key(user_message))
+        if cached is not None:
+            return cached
         
-        if foods_mentioned:
-            print(f"🔍 Looking up nutrition data for: {foods_mentioned}")
-            for food in foods_mentioned[:2]:  # Limit for API efficiency
-                food_data = self.search_food_nutrition(food, limit=1)
-                if food_data:
-                    food_info = food_data[0]
-                    nutrition = food_info.get('nutrition', {})
-                    nutrition_context += f"""
-Food: {food_info.get('description', food)}
-- Calories: {nutrition.get('calories', 'N/A')} per 100g
-- Protein: {nutrition.get('protein_g', 'N/A')}g
-- Carbohydrates: {nutrition.get('carbs_g', 'N/A')}g
-- Fat: {nutrition.get('fat_g', 'N/A')}g
-- Fiber: {nutrition.get('fiber_g', 'N/A')}g
-- Sugar: {nutrition.get('sugar_g', 'N/A')}g
-"""
+        nutrition_context = self._nutrition_context(user_message)
         
         # Generate AI response using Mosaic AI Model Serving
-        return self._generate_ai_response(user_message, nutrition_context)
+        return self._generate_ai_response(user_message, nutrition_context, force_refresh)
     
-    def _generate_ai_response(self, user_message: str, nutrition_context: str) -> str:
-        """Generate response using Mosaic AI Model Serving (OpenAI external model)"""
+    def stream_nutrition_advice(self, user_message: str, force_refresh: bool = False) -> Iterator[str]:
+        """Like generate_nutrition_advice, but yields the answer in pieces as the model produces them"""
+        key = _advice_key(user_message)
+        cached = None if force_refresh else _cached_advice(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        nutrition_context = self._nutrition_context(user_message)
         
         if not self.openai_client:
-            return self._fallback_response(user_message, nutrition_context)
+            yield self._fallback_response(user_message, nutrition_context)
+            return
+        
+        params = self._completion_params(user_message, nutrition_context)
+        cache_key = llm_cache.completion_key(params)
+        cached = None if force_refresh else llm_cache.get_response(cache_key)
+        if cached is not None:
+            _store_advice(key, cached)
+            yield cached
+            return
+        
+        parts = []
+        try:
+            print("🤖 Streaming MosaicML API response...")
+            for delta in self._stream_completion(params):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            print(f"❌ Error with Mosaic AI Model Serving: {e}")
+            # Nothing sent yet: answer from the USDA data instead. Otherwise end the partial answer.
+            if not parts:
+                yield self._fallback_response(user_message, nutrition_context)
+            return
+        if parts:
+            answer = ''.join(parts).strip()
+            llm_cache.put_response(cache_key, answer)
+            _store_advice(key, answer)
+    
+    def _nutrition_context(self, user_message: str) -> str:
+        """USDA nutrition facts for the foods mentioned in the message, as prompt text"""
+        # No USDA database: every lookup would come back empty, so skip extraction too
+        if not usda_available():
+            return ""
+        
+        # Extract food items and get real nutrition data
+        foods_mentioned = self._extract_food_items(user_message)
+        segments = []
         
+        if foods_mentioned:
+            logger.debug("Looking up nutrition data for: %s", foods_mentioned)
+            foods = foods_mentioned[:2]  # Limit for API efficiency
+            # Lookups are independent: run them concurrently (results come back in order)
+            lookups = _LOOKUP_POOL.map(lambda food: self.search_food_nutrition(food, limit=1), foods)
+            for food, food_data in zip(foods, lookups):
+                if food_data:
+                    food_info = food_data[0]
+                    segments.append(f"""
+Food: {food_info.description}
+- Calories: {food_info.calories} per 100g
+- Protein: {food_info.protein_g}g
+- Carbohydrates: {food_info.carbs_g}g
+- Fat: {food_info.fat_g}g
+- Fiber: {food_info.fiber_g}g
+- Sugar: {food_info.sugar_g}g
+""")
+        return "".join(segments)
+    
+    def _completion_params(self, user_message: str, nutrition_context: str) -> dict:
+        """chat.completions.create arguments for a nutrition question"""
         # Create nutrition expert prompt with real USDA data
-        system_prompt = """You are a professional nutrition expert and registered dietitian. 
-You provide accurate, science-based nutrition advice using real USDA food data.
-
-Key guidelines:
-- Always use the provided USDA nutrition data when available
-- Provide specific numbers and percentages 
-- Give practical, actionable advice
-- Mention serving sizes and daily value context
-- Be encouraging and supportive
-- If asked about medical conditions, recommend consulting healthcare providers
-
-Response format (required):
-1) Title (if applicable)
-2) Ingredients or key items (when relevant)
-3) Steps or guidance (numbered, concise)
-4) Macros per serving (required)
-   - Calories: <number> kcal
-   - Protein: <number> g
-   - Carbs: <number> g
-   - Fat: <number> g
-
-Rules for macros:
-- If USDA data is provided, base macros on it. Otherwise, provide best-effort estimates and note they are approximate.
-- Keep units consistent (kcal, g).
-- At the very end, include a single-line JSON object inside these tags for parsing by the app:
-  <MACROS_JSON>{"macros_per_serving": {"calories": <number>, "protein_g": <number>, "carbs_g": <number>, "fat_g": <number>}, "confidence": <0-1> }</MACROS_JSON>
-
-Focus on being helpful, accurate, and educational."""
+        system_prompt = NUTRITION_SYSTEM_PROMPT
 
         user_prompt = f"""User question: {user_message}
 
@@ -167,20 +475,29 @@ Real USDA Nutrition Data:
 
 Please provide a helpful, accurate response based on this real nutrition data."""
 
+        return {
+            "model": "gpt-3.5-turbo",  # Using GPT-3.5-turbo as external model through Mosaic AI
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "max_tokens": 400,
+            "temperature": 0.7,
+        }
+    
+    def _generate_ai_response(self, user_message: str, nutrition_context: str, force_refresh: bool = False) -> str:
+        """Generate response using Mosaic AI Model Serving (OpenAI external model)"""
+        
+        if not self.openai_client:
+            return self._fallback_response(user_message, nutrition_context)
+        
         try:
             print("🤖 Calling MosaicML API...")
-            response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",  # Using GPT-3.5-turbo as external model through Mosaic AI
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=400,
-                temperature=0.7
+            result = self._create_completion(
+                self._completion_params(user_message, nutrition_context), force_refresh
             )
-            
-            result = response.choices[0].message.content.strip()
             print(f"✅ MosaicML response received: {len(result)} characters")
+            _store_advice(_advice_key(user_message), result)
             return result
             
         except Exception as e:
@@ -188,26 +505,109 @@ Please provide a helpful, accurate response based on this real nutrition data.""
             print(f"❌ Error type: {type(e)}")
             return self._fallback_response(user_message, nutrition_context)
     
-    def _extract_food_items(self, message: str) -> List[str]:
-        """Extract potential food items from user message"""
-        message_lower = message.lower()
-        potential_foods = []
+    def _create_completion(self, params: dict, force_refresh: bool = False) -> str:
+        """Text of a chat completion for these exact arguments.
         
-        # Common food keywords for extraction
-        food_keywords = [
-            'chicken', 'beef', 'pork', 'fish', 'salmon', 'tuna', 'turkey',
-            'egg', 'eggs', 'milk', 'cheese', 'yogurt', 'butter',
-            'rice', 'bread', 'pasta', 'oats', 'oatmeal', 'quinoa',
-            'apple', 'banana', 'orange', 'berries', 'avocado', 'spinach',
-            'broccoli', 'carrots', 'potato', 'sweet potato',
-            'beans', 'lentils', 'nuts', 'almonds', 'peanuts'
-        ]
+        Served from the on-disk LLM cache when the same request (model, prompts, sampling
+        settings) was answered before, surviving restarts; force_refresh asks the model again
+        and replaces the stored answer.
+        """
+        key = llm_cache.completion_key(params)
+        if not force_refresh:
+            cached = llm_cache.get_response(key)
+            if cached is not None:
+                print("💾 Using cached model response")
+                return cached
+        with _openai_slots:
+            response = self.openai_client.chat.completions.create(**params)
+        result = response.choices[0].message.content.strip()
+        llm_cache.put_response(key, result)
+        return result
+    
+    def estimate_nutrition(self, name: str, description: str, serving_size, serving_unit: str) -> Optional[Dict]:
+        """Per-serving estimate (ESTIMATE_KEYS) for a custom food, or None when the model is
+        unavailable or its answer can't be parsed.
         
-        for keyword in food_keywords:
-            if keyword in message_lower:
-                potential_foods.append(keyword)
+        Estimates are stored in the LLM cache per food, so a food already estimated skips the
+        model; concurrent calls are batched into one model request (see _EstimateBatcher).
+        """
+        key = llm_cache.estimate_key(name, description, serving_size, serving_unit)
+        cached = llm_cache.get_response(key)
+        if cached is not None:
+            return json.loads(cached)
+        if not self.openai_client:
+            return None
+        item = {'name': name, 'description': description, 'serving': f"{serving_size} {serving_unit}"}
+        try:
+            nutrition = _estimate_batcher.submit(item).result()
+        except Exception as e:
+            print(f"❌ Error estimating nutrition: {e}")
+            return None
+        # Only parsed estimates are kept: a failed parse is retried next time
+        if nutrition:
+            llm_cache.put_response(key, json.dumps(nutrition))
+        return nutrition
+    
+    def _estimate_batch(self, items: List[dict]) -> List[Optional[Dict]]:
+        """One model call estimating every item; results line up with items"""
+        listing = "\n".join(
+            f"{i}. Name: {item['name']}\n   Description: {item['description']}\n   Serving size: {item['serving']}"
+            for i, item in enumerate(items, 1)
+        )
+        prompt = f"""Please estimate the nutrition facts for each of these food items:
+
+{listing}
+
+Format your response as a JSON array with one object per item, in the same order, each with these exact keys: {', '.join(ESTIMATE_KEYS)}.
+Provide only reasonable estimates based on typical foods. If you're unsure, be conservative."""
         
-        return potential_foods[:3]  # Limit to avoid long API calls
+        print(f"🤖 Estimating nutrition for {len(items)} food(s) in one call...")
+        answer = self._create_completion({
+            "model": "gpt-3.5-turbo",
+            "messages": [
+                {"role": "system", "content": "You are a nutrition expert who estimates nutrition facts for foods."},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": 80 * len(items) + 40,
+            "temperature": 0.7,
+        })
+        
+        start, end = answer.find('['), answer.rfind(']')
+        try:
+            estimates = json.loads(answer[start:end + 1]) if start != -1 and end > start else []
+        except json.JSONDecodeError:
+            estimates = []
+        if not isinstance(estimates, list):
+            estimates = []
+        
+        results = []
+        for i in range(len(items)):
+            entry = estimates[i] if i < len(estimates) and isinstance(estimates[i], dict) else {}
+            nutrition = {key: entry[key] for key in ESTIMATE_KEYS if key in entry}
+            results.append(nutrition or None)
+        return results
+    
+    def _stream_completion(self, params: dict) -> Iterator[str]:
+        """Text pieces of a streamed chat completion, holding an OpenAI slot until it ends"""
+        with _openai_slots:
+            stream = self.openai_client.chat.completions.create(**params, stream=True)
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+    
+    def _extract_food_items(self, message: str) -> List[str]:
+        """Extract potential food items from user message"""
+        mask = 0
+        for match in _FOOD_KEYWORD_RE.finditer(message.lower()):
+            mask |= _KEYWORD_PREFIX_BITS[match.group(1)]
+        
+        potential_foods = []
+        while mask and len(potential_foods) < 3:  # Limit to avoid long API calls
+            low = mask & -mask
+            potential_foods.append(FOOD_KEYWORDS[low.bit_length() - 1])
+            mask ^= low
+        return potential_foods
     
     def _fallback_response(self, user_message: str, nutrition_context: str) -> str:
         """Fallback response when AI service is unavailable"""
@@ -220,54 +620,43 @@ Please provide a helpful, accurate response based on this real nutrition data.""
 
 💡 Tip: Focus on whole foods, balanced macronutrients, and appropriate portion sizes for your goals!"""
         else:
-            return """👋 I'm your AI nutrition assistant powered by Mosaic AI Model Serving!
-
-I can help you with:
-• Food nutrition facts and macro breakdowns
-• Weight management guidance  
-• Muscle building nutrition advice
-• General healthy eating tips
-
-Try asking me about specific foods like:
-• "What are the macros for chicken breast?"
-• "Is avocado good for weight loss?"
-• "How much protein should I eat?"
-
-I use real USDA nutrition data to give you accurate information! 🎯"""
+            return WELCOME_MESSAGE
 
     def get_user_grocery_inventory(self, user_id: str = "demo_user") -> list:
         """Get user's current grocery inventory for recipe suggestions"""
         try:
-            from db import SessionLocal
-            from models import UserGrocery, FoodItem, CustomFood
-            from sqlalchemy.orm import joinedload
-            from datetime import date
-            
             session = SessionLocal()
             try:
-                # Get non-expired groceries
-                groceries = session.query(UserGrocery).filter(
-                    UserGrocery.user_id == user_id,
-                    UserGrocery.is_expired == False,
-                    UserGrocery.quantity > 0
-                ).options(
-                    joinedload(UserGrocery.food_item),
-                    joinedload(UserGrocery.custom_food)
+                # Get non-expired groceries as plain rows: just the columns used below, with the
+                # name taken from whichever of FoodItem / CustomFood the row references
+                rows = session.execute(
+                    select(
+                        func.coalesce(FoodItem.name, CustomFood.name).label('name'),
+                        UserGrocery.quantity,
+                        UserGrocery.unit,
+                        UserGrocery.location,
+                        UserGrocery.expiration_date,
+                    ).outerjoin(
+                        FoodItem, UserGrocery.food_item_id == FoodItem.id
+                    ).outerjoin(
+                        CustomFood, UserGrocery.custom_food_id == CustomFood.id
+                    ).where(
+                        UserGrocery.user_id == user_id,
+                        UserGrocery.is_expired == False,
+                        UserGrocery.quantity > 0
+                    )
                 ).all()
                 
+                today = date.today()
                 inventory_list = []
-                for grocery in groceries:
+                for name, quantity, unit, location, expiration_date in rows:
                     # Calculate days until expiry
-                    days_until_expiry = None
-                    if grocery.expiration_date:
-                        days_until_expiry = (grocery.expiration_date - date.today()).days
-                    
-                    food_name = grocery.food_item.name if grocery.food_item else grocery.custom_food.name
+                    days_until_expiry = (expiration_date - today).days if expiration_date else None
                     inventory_list.append({
-                        'name': food_name,
-                        'quantity': grocery.quantity,
-                        'unit': grocery.unit,
-                        'location': grocery.location,
+                        'name': name,
+                        'quantity': quantity,
+                        'unit': unit,
+                        'location': location,
                         'days_until_expiry': days_until_expiry,
                         'priority': 'high' if days_until_expiry and days_until_expiry <= 3 else 'normal'
                     })
@@ -280,105 +669,76 @@ I use real USDA nutrition data to give you accurate information! 🎯"""
             print(f"Warning: Could not fetch user inventory: {e}")
             return []
     
-    def suggest_recipes_with_inventory(self, user_message: str, user_id: str = "demo_user") -> str:
-        """Generate recipe suggestions based on user's available groceries"""
+    def suggest_recipes_with_inventory(self, user_message: str, user_id: str = "demo_user", force_refresh: bool = False) -> str:
+        """Generate recipe suggestions based on user's available groceries.
         
+        The same question over the same inventory reuses the stored answer unless force_refresh.
+        """
+        inventory_context = self._inventory_context(user_id)
+        
+        # Generate AI response with inventory context
+        return self._generate_inventory_aware_response(user_message, inventory_context, force_refresh)
+    
+    def stream_recipes_with_inventory(self, user_message: str, user_id: str = "demo_user", force_refresh: bool = False) -> Iterator[str]:
+        """Like suggest_recipes_with_inventory, but yields the answer in pieces as the model produces them"""
+        if not self.ready:
+            raise Exception("MosaicML client not ready")
+        
+        inventory_context = self._inventory_context(user_id)
+        params = self._inventory_completion_params(user_message, inventory_context)
+        cache_key = llm_cache.completion_key(params)
+        cached = None if force_refresh else llm_cache.get_response(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        print("🍳 Streaming inventory-aware recipe suggestions...")
+        parts = []
+        for delta in self._stream_completion(params):
+            parts.append(delta)
+            yield delta
+        if parts:
+            llm_cache.put_response(cache_key, ''.join(parts).strip())
+    
+    def _inventory_context(self, user_id: str) -> str:
+        """The user's groceries as prompt text, expiring items first"""
         # Get user's current inventory
         inventory = self.get_user_grocery_inventory(user_id)
         
+        if not inventory:
+            return "\n(No grocery inventory available - providing general recipe advice)\n"
+        
         # Create inventory context
-        inventory_context = ""
-        if inventory:
-            inventory_context = "\nUser's Current Grocery Inventory:\n"
-            high_priority_items = [item for item in inventory if item['priority'] == 'high']
-            normal_items = [item for item in inventory if item['priority'] == 'normal']
-            
-            if high_priority_items:
-                inventory_context += "⚠️ EXPIRING SOON (use first):\n"
-                for item in high_priority_items:
-                    inventory_context += f"- {item['quantity']} {item['unit']} {item['name']} (expires in {item['days_until_expiry']} days)\n"
-            
-            if normal_items:
-                inventory_context += "\n📦 Available ingredients:\n"
-                for item in normal_items[:10]:  # Limit for prompt size
-                    expiry_info = f" (expires in {item['days_until_expiry']} days)" if item['days_until_expiry'] else ""
-                    inventory_context += f"- {item['quantity']} {item['unit']} {item['name']}{expiry_info}\n"
-        else:
-            inventory_context = "\n(No grocery inventory available - providing general recipe advice)\n"
+        lines = ["\nUser's Current Grocery Inventory:\n"]
+        # Partition by priority in one pass
+        high_priority_items, normal_items = [], []
+        for item in inventory:
+            (high_priority_items if item['priority'] == 'high' else normal_items).append(item)
         
-        # Generate AI response with inventory context
-        return self._generate_inventory_aware_response(user_message, inventory_context)
+        if high_priority_items:
+            lines.append("⚠️ EXPIRING SOON (use first):\n")
+            for item in high_priority_items:
+                lines.append(f"- {item['quantity']} {item['unit']} {item['name']} (expires in {item['days_until_expiry']} days)\n")
+        
+        if normal_items:
+            lines.append("\n📦 Available ingredients:\n")
+            for item in normal_items[:10]:  # Limit for prompt size
+                expiry_info = f" (expires in {item['days_until_expiry']} days)" if item['days_until_expiry'] else ""
+                lines.append(f"- {item['quantity']} {item['unit']} {item['name']}{expiry_info}\n")
+        
+        return "".join(lines)
     
-    def _generate_inventory_aware_response(self, user_message: str, inventory_context: str) -> str:
+    def _generate_inventory_aware_response(self, user_message: str, inventory_context: str, force_refresh: bool = False) -> str:
         """Generate recipe suggestions considering user's inventory"""
         
         if not self.ready:
             raise Exception("MosaicML client not ready")
         
-        system_prompt = """You are a creative chef and nutrition expert who specializes in helping people use their existing groceries efficiently.
-        
-Key guidelines:
-- PRIORITIZE ingredients that are expiring soon (1–3 days) to reduce food waste
-- Suggest recipes that use multiple items from their inventory
-- Provide specific, actionable recipe suggestions with steps
-- Include approximate cooking times and difficulty levels
-- If they have expiring items, emphasize using those first
-- Be creative but practical with ingredient substitutions
-- Include nutritional benefits when relevant
-- NO introductions, preambles, or chatty phrases at the beginning - start directly with the recipe content
-- Keep the title and serving information prominent at the top
-- A pleasant sign-off at the end is acceptable
-
-STRICT Response format (follow exactly):
-
-[Recipe Title]
-Servings: X | Total Time: X minutes
-
-Ingredients
-- [natural quantities: "1 chicken breast", "2 cups milk", never "1.0 items"]
-- [only use units that make sense: oz/ml for liquids, cups for measured items]
-
-Steps
-1. [Clear cooking instruction]
-2. [Next cooking instruction]
-
-Macros per serving
-- Calories: [number] kcal
-- Protein: [number] g
-- Carbs: [number] g  
-- Fat: [number] g
-
-IMPORTANT: Follow this format exactly every time. Do not deviate.
-IMPORTANT: NO labels before the title - start directly with the recipe name (not "Title:" or "Recipe:").
-IMPORTANT: Do not put the title in brackets - just write the recipe name directly.
-
-Rules for macros:
-- If USDA data is provided, base macros on it. Otherwise, provide best-effort estimates and note they are approximate.
-- Keep units consistent (kcal, g).
-- At the very end, include a single-line JSON object inside these tags for parsing by the app:
-  <MACROS_JSON>{"macros_per_serving": {"calories": <number>, "protein_g": <number>, "carbs_g": <number>, "fat_g": <number>}, "confidence": <0-1> }</MACROS_JSON>
-
-Respond with enthusiasm and practical cooking advice!"""
-
-        user_prompt = f"""User question: {user_message}
-
-{inventory_context}
-
-Based on their available groceries, please suggest specific recipes they can make. Focus especially on using items that are expiring soon to minimize food waste!"""
-
         try:
             print("🍳 Generating inventory-aware recipe suggestions...")
-            response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=600,
-                temperature=0.6  # Lower temperature for more consistent formatting
+            result = self._create_completion(
+                self._inventory_completion_params(user_message, inventory_context), force_refresh
             )
-            
-            result = response.choices[0].message.content.strip()
             print(f"✅ Recipe suggestions generated: {len(result)} characters")
             return result
             
@@ -386,6 +746,26 @@ Based on their available groceries, please suggest specific recipes they can mak
             print(f"❌ Error generating recipe suggestions: {e}")
             raise e
     
+    def _inventory_completion_params(self, user_message: str, inventory_context: str) -> dict:
+        """chat.completions.create arguments for an inventory-aware recipe request"""
+        system_prompt = RECIPE_SYSTEM_PROMPT
+
+        user_prompt = f"""User question: {user_message}
+
+{inventory_context}
+
+Based on their available groceries, please suggest specific recipes they can make. Focus especially on using items that are expiring soon to minimize food waste!"""
+
+        return {
+            "model": "gpt-3.5-turbo",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "max_tokens": 600,
+            "temperature": 0.6,  # Lower temperature for more consistent formatting
+        }
+    
     def is_ready(self) -> bool:
         """Check if Mosaic AI Model Serving is ready"""
         return hasattr(self, 'ready') and self.ready and self.openai_client is not None
@@ -395,19 +775,23 @@ Based on their available groceries, please suggest specific recipes they can mak
         Returns a dict with keys like macros_per_serving and confidence, or None if not found/parsable.
         """
         try:
-            import re, json
-            # Primary: look for tagged JSON
-            m = re.search(r"<MACROS_JSON>\s*(\{.*?\})\s*</MACROS_JSON>", text, re.DOTALL)
-            if m:
-                return json.loads(m.group(1))
+            # Primary: look for tagged JSON (substring test first: no regex scan when absent)
+            if '<MACROS_JSON>' in text:
+                m = _MACROS_TAG_RE.search(text)
+                if m:
+                    return json.loads(m.group(1))
             # Fallback: try to find a trailing JSON object
-            m2 = re.search(r"(\{\s*\"macros_per_serving\".*\})", text, re.DOTALL)
-            if m2:
-                return json.loads(m2.group(1))
+            if '"macros_per_serving"' in text:
+                m2 = _MACROS_FALLBACK_RE.search(text)
+                if m2:
+                    return json.loads(m2.group(1))
         except Exception:
             return None
         return None
 
 
-# Global instance for Flask app
-mosaic_nutrition_ai = MosaicNutritionAI()
\ No newline at end of file
+# Shared instance for the Flask app, created on first use so importing this module (and the
+# routes that never call the model) doesn't set up the OpenAI client
+@lru_cache(maxsize=1)
+def get_mosaic_nutrition_ai() -> MosaicNutritionAI:
+    return MosaicNutritionAI()
\ No newline at end of file
@@ -5,6 +5,10 @@ This does NOT require the USDA vendor database; it populates your app's own tabl
 """
 from datetime import date, timedelta
 
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
 from db import SessionLocal
 from models import FoodItem, NutritionFacts
 
@@ -59,55 +63,60 @@ SAMPLES = [
     },
 ]
 
-def upsert_food(session, sample):
-    name = sample["name"]
-    brand = sample.get("brand")
-    upc = sample.get("upc")
-    category = sample.get("category")
+NUTRITION_FIELDS = [
+    "serving_size", "serving_unit", "calories", "protein_g", "carbs_g", "fat_g", "fiber_g", "sugar_g",
+]
+
+
+def _upsert_insert(session):
+    """Dialect-specific insert() that supports ON CONFLICT DO UPDATE."""
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql_insert
+    return sqlite_insert
+
+
+def seed_foods(session, samples):
+    """Insert missing sample FoodItems and upsert every sample's NutritionFacts.
 
-    existing = (
-        session.query(FoodItem)
-        .filter(FoodItem.name == name)
-        .filter(FoodItem.brand == brand)
-        .filter(FoodItem.upc == upc)
-        .first()
-    )
-    item = existing
-    if not item:
-        item = FoodItem(name=name, brand=brand, category=category, upc=upc, is_perishable=True)
-        session.add(item)
-        session.flush()
+    Fixed number of statements regardless of len(samples): one SELECT of the existing items,
+    one executemany INSERT for the missing ones, one multi-row nutrition upsert.
+    """
+    keys = [(s["name"], s.get("brand"), s.get("upc")) for s in samples]
+    ids = {
+        (name, brand, upc): food_id
+        for food_id, name, brand, upc in session.execute(
+            select(FoodItem.id, FoodItem.name, FoodItem.brand, FoodItem.upc)
+            .where(FoodItem.name.in_({name for name, _, _ in keys}))
+        )
+    }
 
-    # Upsert nutrition facts
-    nf = item.nutrition
-    if nf:
-        session.delete(nf)
-        session.flush()
+    missing = [(key, s) for key, s in zip(keys, samples) if key not in ids]
+    if missing:
+        new_ids = session.scalars(
+            insert(FoodItem).returning(FoodItem.id, sort_by_parameter_order=True),
+            [
+                {"name": name, "brand": brand, "category": s.get("category"), "upc": upc, "is_perishable": True}
+                for (name, brand, upc), s in missing
+            ],
+        ).all()
+        ids.update(zip((key for key, _ in missing), new_ids))
 
-    n = sample["nutrition"]
-    nf = NutritionFacts(
-        food_item_id=item.id,
-        serving_size=n.get("serving_size"),
-        serving_unit=n.get("serving_unit"),
-        calories=n.get("calories"),
-        protein_g=n.get("protein_g"),
-        carbs_g=n.get("carbs_g"),
-        fat_g=n.get("fat_g"),
-        fiber_g=n.get("fiber_g"),
-        sugar_g=n.get("sugar_g"),
-    )
-    session.add(nf)
-    session.flush()
-    return item.id
+    # Replace the nutrition facts of every sample (food_item_id is unique)
+    stmt = _upsert_insert(session)(NutritionFacts).values([
+        {"food_item_id": ids[key], **{field: s["nutrition"].get(field) for field in NUTRITION_FIELDS}}
+        for key, s in zip(keys, samples)
+    ])
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[NutritionFacts.food_item_id],
+        set_={field: stmt.excluded[field] for field in NUTRITION_FIELDS},
+    ))
+    return [{"name": key[0], "id": ids[key]} for key in keys]
 
 
 def main():
     session = SessionLocal()
     try:
-        ids = []
-        for s in SAMPLES:
-            fid = upsert_food(session, s)
-            ids.append({"name": s["name"], "id": fid})
+        ids = seed_foods(session, SAMPLES)
         session.commit()
         print({"seeded": ids})
     except Exception as e:
@@ -15,12 +15,12 @@ def test_ai_chat_directly():
     print("🧪 Testing AI chat directly...")
     
     try:
-        from mosaic_nutrition_ai import mosaic_nutrition_ai
+        from mosaic_nutrition_ai import get_mosaic_nutrition_ai
         
         user_message = "What are the health benefits of chicken breast?"
         print(f"📝 User message: {user_message}")
         
-        response = mosaic_nutrition_ai.generate_nutrition_advice(user_message)
+        response = get_mosaic_nutrition_ai().generate_nutrition_advice(user_message)
         print(f"✅ AI Response ({len(response)} chars):")
         print(f"{response[:200]}...")
         
@@ -42,11 +42,15 @@ def test_flask_api():
     print("🧪 Testing Flask API endpoints...")
     
     base_url = "http://127.0.0.1:5001"
-    
+    # One pooled keep-alive connection for all three calls
+    with requests.Session() as session:
+        return _run_flask_api_checks(session, base_url)
+
+def _run_flask_api_checks(session, base_url):
     # Test basic endpoint
     try:
         print("📡 Testing /api/time endpoint...")
-        response = requests.get(f"{base_url}/api/time", timeout=5)
+        response = session.get(f"{base_url}/api/time", timeout=5)
         if response.status_code == 200:
             print("✅ /api/time endpoint working")
         else:
@@ -58,7 +62,7 @@ def test_flask_api():
     # Test AI status endpoint
     try:
         print("📡 Testing /api/ai/status endpoint...")
-        response = requests.get(f"{base_url}/api/ai/status", timeout=5)
+        response = session.get(f"{base_url}/api/ai/status", timeout=5)
         if response.status_code == 200:
             print("✅ /api/ai/status endpoint working")
             print(f"📊 Status: {response.json()}")
@@ -71,12 +75,7 @@ def test_flask_api():
     try:
         print("📡 Testing /api/ai/chat endpoint...")
         payload = {"message": "What are the benefits of eating apples?"}
-        response = requests.post(
-            f"{base_url}/api/ai/chat", 
-            json=payload, 
-            timeout=30,
-            headers={"Content-Type": "application/json"}
-        )
+        response = session.post(f"{base_url}/api/ai/chat", json=payload, timeout=30)
         
         if response.status_code == 200:
             result = response.json()
@@ -90,10 +89,24 @@ def test_flask_api():
         
     return True
 
+def wait_for_server(base_url, attempts=30):
+    """Poll /api/time until the server answers (or give up after ~3s)"""
+    for _ in range(attempts):
+        try:
+            requests.get(f"{base_url}/api/time", timeout=0.2)
+            return True
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    return False
+
 if __name__ == "__main__":
     print("🚀 Starting complete API tests...")
     print("=" * 60)
     
+    # Start Flask server in background thread first so its startup overlaps the direct test
+    server_thread = Thread(target=run_flask_server, daemon=True)
+    server_thread.start()
+    
     # Test 1: Direct AI functionality
     success1 = test_ai_chat_directly()
     
@@ -101,13 +114,9 @@ if __name__ == "__main__":
         print("\n" + "=" * 60)
         print("🌐 Testing with Flask server...")
         
-        # Start Flask server in background thread
-        server_thread = Thread(target=run_flask_server, daemon=True)
-        server_thread.start()
-        
-        # Wait for server to start
+        # Usually ready by now; otherwise wait for it to accept connections
         print("⏳ Waiting for server to start...")
-        time.sleep(3)
+        wait_for_server("http://127.0.0.1:5001")
         
         # Test Flask API
         success2 = test_flask_api()
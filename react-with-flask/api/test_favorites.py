@@ -6,13 +6,18 @@ Quick smoke test for Favorites endpoints
 import requests
 
 def test_favorites():
+    # One pooled keep-alive connection for the whole flow
+    with requests.Session() as session:
+        return _run_favorites_flow(session)
+
+def _run_favorites_flow(session):
     base_url = "http://127.0.0.1:5001"
     user_id = "demo_user"
 
     print("\n⭐ Testing Favorites endpoints")
 
     # 1) List current favorites
-    r = requests.get(f"{base_url}/api/favorites?user_id={user_id}")
+    r = session.get(f"{base_url}/api/favorites?user_id={user_id}")
     if r.status_code == 200:
         data = r.json()
         print(f"Favorites before: {data['total_count']}")
@@ -22,7 +27,7 @@ def test_favorites():
 
     # 2) Try adding a favorite by custom_food_id=1 (if exists)
     payload = {"user_id": user_id, "custom_food_id": 1, "display_name": "My leftover"}
-    r = requests.post(f"{base_url}/api/favorites", json=payload)
+    r = session.post(f"{base_url}/api/favorites", json=payload)
     if r.status_code in (201, 409):
         print("Add favorite status:", r.status_code)
     else:
@@ -30,7 +35,7 @@ def test_favorites():
         return False
 
     # 3) List again
-    r = requests.get(f"{base_url}/api/favorites?user_id={user_id}")
+    r = session.get(f"{base_url}/api/favorites?user_id={user_id}")
     if r.status_code == 200:
         data = r.json()
         print(f"Favorites after: {data['total_count']}")
@@ -44,7 +49,7 @@ def test_favorites():
         return False
 
     # 4) Delete one favorite
-    r = requests.delete(f"{base_url}/api/favorites/{fav_id}?user_id={user_id}")
+    r = session.delete(f"{base_url}/api/favorites/{fav_id}?user_id={user_id}")
     if r.status_code == 200:
         print("Deleted favorite", fav_id)
     else:
@@ -21,12 +21,8 @@ def test_recipe_api():
     
     try:
         print("📡 Sending request to Flask API...")
-        response = requests.post(
-            f"{base_url}/api/ai/chat", 
-            json=payload, 
-            timeout=45,
-            headers={"Content-Type": "application/json"}
-        )
+        with requests.Session() as session:
+            response = session.post(f"{base_url}/api/ai/chat", json=payload, timeout=45)
         
         if response.status_code == 200:
             result = response.json()
@@ -5,11 +5,17 @@ Comprehensive test of the grocery tracking and expiration features
 
 import requests
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 
 def test_grocery_features():
     """Test all grocery tracking functionality"""
-    
+    # One pooled keep-alive connection for every step
+    with requests.Session() as session:
+        return _run_grocery_checks(session)
+
+def _run_grocery_checks(session):
     base_url = "http://127.0.0.1:5001"
     user_id = "test_user"
     
@@ -34,7 +40,7 @@ def test_grocery_features():
             "nutrition_estimated": False
         }
         
-        response = requests.post(f"{base_url}/api/custom-foods", json=custom_food_data)
+        response = session.post(f"{base_url}/api/custom-foods", json=custom_food_data)
         if response.status_code == 201:
             custom_food = response.json()
             custom_food_id = custom_food['id']
@@ -52,10 +58,13 @@ def test_grocery_features():
             "serving_unit": "bowl"
         }
         
-        response = requests.post(f"{base_url}/api/custom-foods/estimate-nutrition", json=estimation_data)
+        # Estimates are cached per food: on a second run of this script this comes back in ms
+        start = time.perf_counter()
+        response = session.post(f"{base_url}/api/custom-foods/estimate-nutrition", json=estimation_data)
+        elapsed_ms = (time.perf_counter() - start) * 1000
         if response.status_code == 200:
             estimation = response.json()
-            print(f"✅ AI nutrition estimation: {estimation['confidence']*100:.0f}% confidence")
+            print(f"✅ AI nutrition estimation: {estimation['confidence']*100:.0f}% confidence ({elapsed_ms:.0f} ms)")
             print(f"   Estimated calories: {estimation['estimated_nutrition']['calories']}")
         else:
             print(f"⚠️ AI estimation failed: {response.text}")
@@ -87,23 +96,38 @@ def test_grocery_features():
             }
         ]
         
+        # One request and one INSERT for all of them (created items come back in order)
+        response = session.post(
+            f"{base_url}/api/groceries/bulk",
+            json={"user_id": user_id, "items": groceries_to_add}
+        )
+        
         added_groceries = []
-        for grocery_data in groceries_to_add:
-            grocery_data["user_id"] = user_id
-            response = requests.post(f"{base_url}/api/groceries", json=grocery_data)
-            if response.status_code == 201:
-                added_grocery = response.json()
-                added_groceries.append(added_grocery)
+        if response.status_code == 201:
+            added_groceries = response.json()['items']
+            for grocery_data in groceries_to_add:
                 food_type = grocery_data['food_type']
                 quantity = grocery_data['quantity']
                 unit = grocery_data['unit']
                 print(f"✅ Added {quantity} {unit} of {food_type} food to inventory")
-            else:
-                print(f"❌ Failed to add grocery: {response.text}")
+        else:
+            print(f"❌ Failed to add groceries: {response.text}")
+        
+        # Steps 4, 5 and 7 only read state, and the update in step 6 doesn't touch what step 7
+        # lists: fetch all three at once (one round trip of wall-clock instead of three)
+        read_urls = {
+            "inventory": f"{base_url}/api/groceries?user_id={user_id}",
+            "expiring": f"{base_url}/api/groceries/expiring?user_id={user_id}&days=7",
+            "custom_foods": f"{base_url}/api/custom-foods?user_id={user_id}",
+        }
+        with ThreadPoolExecutor(max_workers=len(read_urls)) as executor:
+            # requests.Session isn't thread-safe, so each concurrent read uses its own connection
+            futures = {name: executor.submit(requests.get, url) for name, url in read_urls.items()}
+            reads = {name: future.result() for name, future in futures.items()}
         
         # ===== Test 4: View grocery inventory =====
         print("\n📦 Step 4: Viewing grocery inventory")
-        response = requests.get(f"{base_url}/api/groceries?user_id={user_id}")
+        response = reads["inventory"]
         if response.status_code == 200:
             inventory = response.json()
             print(f"✅ Current inventory: {inventory['total_items']} items")
@@ -122,7 +146,7 @@ def test_grocery_features():
         
         # ===== Test 5: Check expiring items =====
         print("\n⏰ Step 5: Checking expiring items")
-        response = requests.get(f"{base_url}/api/groceries/expiring?user_id={user_id}&days=7")
+        response = reads["expiring"]
         if response.status_code == 200:
             expiring = response.json()
             print(f"✅ Found {expiring['total_count']} items expiring in next 7 days")
@@ -145,7 +169,7 @@ def test_grocery_features():
                 "notes": "Opened package, ate 2 slices"
             }
             
-            response = requests.put(f"{base_url}/api/groceries/{grocery_id}", json=update_data)
+            response = session.put(f"{base_url}/api/groceries/{grocery_id}", json=update_data)
             if response.status_code == 200:
                 print(f"✅ Updated grocery item {grocery_id}")
             else:
@@ -153,7 +177,7 @@ def test_grocery_features():
         
         # ===== Test 7: Get custom foods list =====
         print("\n📝 Step 7: Viewing custom foods")
-        response = requests.get(f"{base_url}/api/custom-foods?user_id={user_id}")
+        response = reads["custom_foods"]
         if response.status_code == 200:
             custom_foods = response.json()
             print(f"✅ Found {custom_foods['total_count']} custom foods")
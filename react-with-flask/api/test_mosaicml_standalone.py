@@ -11,21 +11,25 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-def test_mosaicml_direct():
+def make_client():
+    """One client for both tests: the second call reuses the first one's pooled connection
+    instead of building a new HTTP client and redoing the TLS handshake"""
+    print("⏳ Initializing OpenAI client...")
+    try:
+        client = OpenAI(api_key=os.getenv("OPENAI_KEY"), timeout=30.0)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        print(f"❌ Error type: {type(e)}")
+        return None
+    print("✅ Client initialized successfully")
+    return client
+
+def test_mosaicml_direct(client):
     """Test MosaicML API directly without any Flask dependencies"""
     
     print("🧪 Testing MosaicML API directly...")
     
-    api_key = os.getenv("OPENAI_KEY")
-    
     try:
-        print("⏳ Initializing OpenAI client...")
-        client = OpenAI(
-            api_key=api_key,
-            timeout=30.0
-        )
-        print("✅ Client initialized successfully")
-        
         print("⏳ Making API call...")
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -48,17 +52,13 @@ def test_mosaicml_direct():
         print(f"❌ Error type: {type(e)}")
         return False
 
-def test_nutrition_ai_without_flask():
+def test_nutrition_ai_without_flask(client):
     """Test the nutrition AI logic without Flask circular dependency"""
     
     print("\n🧪 Testing nutrition AI logic without Flask...")
     
     # Simple version that doesn't call Flask API
-    api_key = os.getenv("OPENAI_KEY")
-    
     try:
-        client = OpenAI(api_key=api_key, timeout=30.0)
-        
         user_message = "I want to know about the nutrition in chicken breast"
         
         # Mock nutrition data (what we'd normally get from USDA)
@@ -116,11 +116,13 @@ if __name__ == "__main__":
     print("🚀 Starting MosaicML standalone tests...")
     print("=" * 60)
     
+    client = make_client()
+    
     # Test 1: Direct API call
-    success1 = test_mosaicml_direct()
+    success1 = client is not None and test_mosaicml_direct(client)
     
     # Test 2: Nutrition AI logic without Flask
-    success2 = test_nutrition_ai_without_flask()
+    success2 = client is not None and test_nutrition_ai_without_flask(client)
     
     print("\n" + "=" * 60)
     print("📊 Test Results:")
@@ -3,10 +3,11 @@
 Test script to see the full AI response from the Flask API
 """
 
+import orjson
 import requests
-import json
+import time
 
-def test_ai_response():
+def test_ai_response(session):
     """Test the AI chat and show full response"""
     
     base_url = "http://127.0.0.1:5001"
@@ -19,12 +20,7 @@ def test_ai_response():
     print("\n" + "="*60)
     
     try:
-        response = requests.post(
-            f"{base_url}/api/ai/chat", 
-            json=payload, 
-            timeout=30,
-            headers={"Content-Type": "application/json"}
-        )
+        response = session.post(f"{base_url}/api/ai/chat", json=payload, timeout=30)
         
         if response.status_code == 200:
             result = response.json()
@@ -50,5 +46,57 @@ def test_ai_response():
     except Exception as e:
         print(f"❌ Error: {e}")
 
+def test_ai_response_stream(session):
+    """Same question over /api/ai/chat/stream: time to first token vs. the whole answer"""
+    
+    base_url = "http://127.0.0.1:5001"
+    payload = {"message": "What are the health benefits of salmon?"}
+    
+    print("\n🧪 Testing streamed AI chat response...")
+    print("\n" + "="*60)
+    
+    try:
+        start = time.perf_counter()
+        first_token = None
+        parts = []
+        event = None
+        with session.post(f"{base_url}/api/ai/chat/stream", json=payload, timeout=30, stream=True) as response:
+            if response.status_code != 200:
+                print(f"❌ HTTP Error {response.status_code}")
+                print(f"Response: {response.text}")
+                return
+            
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = orjson.loads(line[len("data: "):])
+                    if event == "error":
+                        print(f"\n❌ Stream error: {data['error']}")
+                        return
+                    if event is None:
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        parts.append(data['delta'])
+                        print(data['delta'], end="", flush=True)
+                elif not line:
+                    event = None
+        total = time.perf_counter() - start
+        
+        print("\n" + "-"*50)
+        print(f"✅ Streamed {len(''.join(parts))} characters")
+        if first_token is not None:
+            print(f"   First token after: {first_token:.2f}s")
+        print(f"   Full answer after: {total:.2f}s")
+            
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to Flask server")
+        print("💡 Make sure to start the server first with: python api.py")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+
 if __name__ == "__main__":
-    test_ai_response()
\ No newline at end of file
+    # Both tests share one keep-alive connection
+    with requests.Session() as session:
+        test_ai_response(session)
+        test_ai_response_stream(session)
\ No newline at end of file
@@ -1,8 +1,21 @@
 from __future__ import annotations
 
+from functools import cache
 from pathlib import Path
+import logging
 import os
-from sqlalchemy import create_engine
+import sqlite3
+import threading
+from sqlalchemy import create_engine, event
+
+# pysqlite3-binary bundles a newer SQLite than most system Pythons (better query planning for
+# the search JOINs, faster FTS5); it's optional and the stdlib module is used without it
+try:
+    from pysqlite3 import dbapi2 as sqlite_dbapi
+except ImportError:
+    sqlite_dbapi = sqlite3
+
+logger = logging.getLogger(__name__)
 
 
 def get_usda_db_path() -> Path:
@@ -19,7 +32,25 @@ def get_usda_db_path() -> Path:
     return db_path
 
 
+_engine_lock = threading.Lock()
+
+
 def get_usda_engine():
+    """The app's read-only USDA engine, created on first use rather than at import.
+
+    Raises FileNotFoundError while the DB file is missing; that isn't cached, so a DB placed
+    later is picked up without a restart. get_usda_engine.cache_clear() drops the engine (tests).
+    """
+    if _create_usda_engine.cache_info().currsize:
+        return _create_usda_engine()
+    # First use: concurrent first requests wait here so only one of them builds the engine
+    # (and its pool); the rest find it in the cache
+    with _engine_lock:
+        return _create_usda_engine()
+
+
+@cache
+def _create_usda_engine():
     db_path = get_usda_db_path()
     if not db_path.exists():
         raise FileNotFoundError(
@@ -27,12 +58,42 @@ def get_usda_engine():
         )
     # Read-only connection: use URI mode with mode=ro
     url = f"sqlite+pysqlite:///{db_path.as_posix()}?mode=ro"
-    engine = create_engine(url, connect_args={"uri": True, "check_same_thread": False}, future=True)
+    # Read-only local file: a checked-out connection can't go stale, so no pre-ping SELECT and
+    # no recycling. Pool sized for request threads plus the nutrition lookup pool running at once.
+    engine = create_engine(
+        url,
+        module=sqlite_dbapi,
+        connect_args={"uri": True, "check_same_thread": False},
+        future=True,
+        pool_size=20,
+        max_overflow=10,
+        pool_pre_ping=False,
+    )
+
+    @event.listens_for(engine, "connect")
+    def _tune_connection(dbapi_conn, connection_record):
+        # Read-only workload over a large file: map it into memory so repeated lookups are served
+        # without read() syscalls. The page cache is per connection (up to pool_size + max_overflow
+        # of them per worker), so it stays modest at 8MB; the shared mmap does most of the work
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.execute("PRAGMA mmap_size = 1073741824")  # 1GB
+        cursor.execute("PRAGMA cache_size = -8192")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        cursor.close()
+
+    logger.info("USDA engine using SQLite %s (%s)", sqlite_dbapi.sqlite_version, sqlite_dbapi.__name__)
     return engine
 
 
-# Singleton-like engine for app use
-try:
-    USDA_ENGINE = get_usda_engine()
-except FileNotFoundError:
-    USDA_ENGINE = None  # Endpoint handlers will return a helpful error until the DB is placed
\ No newline at end of file
+get_usda_engine.cache_clear = _create_usda_engine.cache_clear
+get_usda_engine.cache_info = _create_usda_engine.cache_info
+
+
+def usda_available() -> bool:
+    """Whether the USDA DB is in place; endpoint handlers return a helpful error until it is."""
+    try:
+        get_usda_engine()
+    except FileNotFoundError:
+        return False
+    return True
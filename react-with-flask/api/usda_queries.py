@@ -1,8 +1,18 @@
 from __future__ import annotations
 
-from typing import Iterable, Optional
-from sqlalchemy import text
-from sqlalchemy.engine import Engine, Row
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import Optional, Union
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection, Engine
+
+# Support both package and script execution
+try:
+    from . import usda_db
+except ImportError:  # running as a script
+    import os, sys
+    sys.path.append(os.path.dirname(__file__))
+    import usda_db
 
 # FoodData Central standard nutrient IDs (kcal, grams)
 NUTRIENT_IDS = {
@@ -14,28 +24,69 @@ NUTRIENT_IDS = {
     "sugar_g": 2000,
 }
 
+# nutrient_id -> key used in the nutrient dicts returned below
+NUTRIENT_KEYS = {
+    NUTRIENT_IDS["calories_kcal"]: "calories",
+    NUTRIENT_IDS["protein_g"]: "protein_g",
+    NUTRIENT_IDS["carbs_g"]: "carbs_g",
+    NUTRIENT_IDS["fat_g"]: "fat_g",
+    NUTRIENT_IDS["fiber_g"]: "fiber_g",
+    NUTRIENT_IDS["sugar_g"]: "sugar_g",
+}
 
-def search_usda(engine: Engine, q: str, limit: int = 20) -> list[dict]:
-    # Searches across ALL food descriptions, including both branded and unbranded foods
-    # Balances results to show variety from different data sources
-    sql = text(
-        """
-        SELECT f.fdc_id,
-               f.description,
-               f.data_type,
-               COALESCE(b.brand_name, b.brand_owner) AS brand,
-               b.brand_name,
-               b.brand_owner,
-               b.gtin_upc,
-               b.serving_size,
-               b.serving_size_unit
+
+# The query helpers below take either the engine (checking a connection out per call) or an
+# already open Connection, so one request can run several lookups over a single checkout.
+Bind = Union[Engine, Connection]
+
+
+def _connect(bind: Bind):
+    """Context manager yielding a connection: `bind` itself if it is one (left open for its
+    owner), else a fresh checkout from the engine that is returned on exit."""
+    return nullcontext(bind) if isinstance(bind, Connection) else bind.connect()
+
+
+# Shared by search_usda and search_usda_distinct: rows matching :pat / :q, and their ranking
+_SEARCH_MATCH = """
         FROM food f
         LEFT JOIN branded_food b ON b.fdc_id = f.fdc_id
         WHERE f.description LIKE :pat
            OR b.brand_name LIKE :pat
            OR b.brand_owner LIKE :pat
            OR b.gtin_upc = :q
-        ORDER BY 
+"""
+# Same rows, found through the food_fts trigram index (see build_usda_sqlite.create_search_index)
+# and the gtin_upc index instead of a LIKE scan over every food. Trigrams need 3+ characters, so
+# shorter queries, and databases built without the index, use _SEARCH_MATCH.
+_SEARCH_MATCH_FTS = """
+        FROM food f
+        LEFT JOIN branded_food b ON b.fdc_id = f.fdc_id
+        WHERE f.fdc_id IN (
+            SELECT rowid FROM food_fts WHERE food_fts MATCH :fts_q
+            UNION
+            SELECT fdc_id FROM branded_food WHERE gtin_upc = :q
+        )
+"""
+FTS_MIN_QUERY_LENGTH = 3
+
+# Table names of each USDA database (by URL), read once: the optional build-time tables
+# (food_fts, food_macros) are used when present
+_tables_by_url: dict[str, frozenset] = {}
+
+
+_TABLES_SQL = text("SELECT name FROM sqlite_master WHERE type = 'table'")
+
+
+def _tables(conn: Connection) -> frozenset:
+    url = str(conn.engine.url)
+    if url not in _tables_by_url:
+        _tables_by_url[url] = frozenset(conn.execute(_TABLES_SQL).scalars())
+    return _tables_by_url[url]
+
+
+def _use_search_index(conn: Connection, q: str) -> bool:
+    return "food_fts" in _tables(conn) and len(q) >= FTS_MIN_QUERY_LENGTH
+_SEARCH_ORDER = """
             -- Prioritize exact matches first
             CASE 
                 WHEN f.description LIKE :exact_pat THEN 0
@@ -54,108 +105,251 @@ def search_usda(engine: Engine, q: str, limit: int = 20) -> list[dict]:
             END,
             LENGTH(f.description),
             f.fdc_id DESC
-        LIMIT :limit
-        """
-    )
-    with engine.connect() as conn:
-        rows: Iterable[Row] = conn.execute(sql, {
-            "pat": f"%{q}%", 
-            "exact_pat": f"{q}%",  # For prioritizing exact matches
-            "q": q, 
-            "limit": limit
-        }).fetchall()
-    return [dict(row._mapping) for row in rows]
-
-
-def lookup_upc(engine: Engine, upc: str) -> Optional[dict]:
-    sql = text(
-        """
-        SELECT f.fdc_id,
-               f.description,
-               f.data_type,
-               b.brand_name,
-               b.brand_owner,
-               b.gtin_upc,
-               b.serving_size,
-               b.serving_size_unit
-        FROM branded_food b
-        JOIN food f ON f.fdc_id = b.fdc_id
-        WHERE b.gtin_upc = :upc
-        LIMIT 1
-        """
-    )
-    with engine.connect() as conn:
-        row = conn.execute(sql, {"upc": upc}).fetchone()
-    return dict(row._mapping) if row else None
+"""
 
 
-def get_food_basic(engine: Engine, fdc_id: int) -> Optional[dict]:
-    sql = text(
-        """
+def _search_params(q: str, limit: int) -> dict:
+    return {
+        "pat": f"%{q}%", 
+        "exact_pat": f"{q}%",  # For prioritizing exact matches
+        "q": q, 
+        # The whole query as one FTS5 phrase: a substring match, like :pat
+        "fts_q": '"' + q.replace('"', '""') + '"',
+        "limit": limit
+    }
+
+
+# Statements are built once at import, not per call. The search ones come in two variants keyed
+# by _use_search_index: True finds candidates through food_fts, False with the LIKE scan.
+_SEARCH_SQL = {
+    use_index: text(
+        f"""
         SELECT f.fdc_id,
                f.description,
                f.data_type,
+               COALESCE(b.brand_name, b.brand_owner) AS brand,
                b.brand_name,
                b.brand_owner,
                b.gtin_upc,
                b.serving_size,
                b.serving_size_unit
-        FROM food f
-        LEFT JOIN branded_food b ON b.fdc_id = f.fdc_id
-        WHERE f.fdc_id = :fdc_id
-        LIMIT 1
+        {match}
+        ORDER BY {_SEARCH_ORDER}
+        LIMIT :limit
+        """
+    )
+    for use_index, match in ((True, _SEARCH_MATCH_FTS), (False, _SEARCH_MATCH))
+}
+_SEARCH_DISTINCT_SQL = {
+    use_index: text(
+        f"""
+        SELECT fdc_id, description, data_type
+        FROM (
+            SELECT f.fdc_id,
+                   f.description,
+                   f.data_type,
+                   ROW_NUMBER() OVER (PARTITION BY f.description ORDER BY {_SEARCH_ORDER}) AS dup_rank,
+                   ROW_NUMBER() OVER (ORDER BY {_SEARCH_ORDER}) AS search_rank
+            {match}
+        ) ranked
+        WHERE dup_rank = 1
+        ORDER BY search_rank
+        LIMIT :limit
         """
     )
-    with engine.connect() as conn:
-        row = conn.execute(sql, {"fdc_id": fdc_id}).fetchone()
-    return dict(row._mapping) if row else None
+    for use_index, match in ((True, _SEARCH_MATCH_FTS), (False, _SEARCH_MATCH))
+}
+_UPC_SQL = text(
+    """
+    SELECT f.fdc_id,
+           f.description,
+           f.data_type,
+           b.brand_name,
+           b.brand_owner,
+           b.gtin_upc,
+           b.serving_size,
+           b.serving_size_unit
+    FROM branded_food b
+    JOIN food f ON f.fdc_id = b.fdc_id
+    WHERE b.gtin_upc = :upc
+    LIMIT 1
+    """
+)
+_FOOD_BASIC_SQL = text(
+    """
+    SELECT f.fdc_id,
+           f.description,
+           f.data_type,
+           b.brand_name,
+           b.brand_owner,
+           b.gtin_upc,
+           b.serving_size,
+           b.serving_size_unit
+    FROM food f
+    LEFT JOIN branded_food b ON b.fdc_id = f.fdc_id
+    WHERE f.fdc_id = :fdc_id
+    LIMIT 1
+    """
+)
+
+
+def search_usda(bind: Bind, q: str, limit: int = 20) -> list[dict]:
+    # Searches across ALL food descriptions, including both branded and unbranded foods
+    # Balances results to show variety from different data sources
+    with _connect(bind) as conn:
+        sql = _SEARCH_SQL[_use_search_index(conn, q)]
+        return [dict(row) for row in conn.execute(sql, _search_params(q, limit)).mappings()]
+
+
+def search_usda_distinct(bind: Bind, q: str, limit: int = 20) -> list[dict]:
+    """Like search_usda, but at most one row (the best ranked) per description.
+
+    Deduplicated by the database with a window function, so exactly `limit` distinct rows come
+    back without over-fetching. Returns fdc_id, description and data_type only.
+    """
+    with _connect(bind) as conn:
+        sql = _SEARCH_DISTINCT_SQL[_use_search_index(conn, q)]
+        return [dict(row) for row in conn.execute(sql, _search_params(q, limit)).mappings()]
+
+
+def lookup_upc(bind: Bind, upc: str) -> Optional[dict]:
+    with _connect(bind) as conn:
+        row = conn.execute(_UPC_SQL, {"upc": upc}).mappings().first()
+    return dict(row) if row else None
+
+
+def get_food_basic(bind: Bind, fdc_id: int) -> Optional[dict]:
+    with _connect(bind) as conn:
+        row = conn.execute(_FOOD_BASIC_SQL, {"fdc_id": fdc_id}).mappings().first()
+    return dict(row) if row else None
+
+
+_BULK_NUTRIENTS_SQL = text(
+    """
+    SELECT fn.fdc_id, fn.nutrient_id, fn.amount
+    FROM food_nutrient fn
+    JOIN nutrient n ON n.id = fn.nutrient_id
+    WHERE fn.fdc_id IN :fdc_ids
+      AND fn.nutrient_id IN :nutrient_ids
+    """
+).bindparams(bindparam("fdc_ids", expanding=True), bindparam("nutrient_ids", expanding=True))
 
 
-def get_basic_nutrients(engine: Engine, fdc_id: int) -> dict:
-    # Join food_nutrient -> nutrient and pull a few common macros by nutrient_id
-    # Note: some schemas may store nutrient number differently; adjust if needed
-    # Handle case where food_nutrient table doesn't exist (simplified database)
+# One precomputed row per food (build_usda_sqlite.create_macros_table): a primary-key lookup
+# instead of filtering food_nutrient rows and reshaping them
+MACRO_COLUMNS = tuple(NUTRIENT_KEYS.values())
+_BULK_MACROS_SQL = text(
+    f"""
+    SELECT fdc_id, {", ".join(MACRO_COLUMNS)}
+    FROM food_macros
+    WHERE fdc_id IN :fdc_ids
+    """
+).bindparams(bindparam("fdc_ids", expanding=True))
+
+
+def get_basic_nutrients_bulk(bind: Bind, fdc_ids: list[int]) -> dict[int, dict]:
+    """get_basic_nutrients for many foods in one query: {fdc_id: nutrients} for every id given."""
+    if not fdc_ids:
+        return {}
+    out: dict[int, dict] = {fdc_id: {} for fdc_id in fdc_ids}
     try:
-        sql = text(
-            """
-            SELECT fn.nutrient_id, n.name, n.unit_name, fn.amount
-            FROM food_nutrient fn
-            JOIN nutrient n ON n.id = fn.nutrient_id
-            WHERE fn.fdc_id = :fdc_id
-              AND fn.nutrient_id IN (:cal, :pro, :carb, :fat, :fiber, :sugar)
-            """
-        )
-        with engine.connect() as conn:
+        with _connect(bind) as conn:
+            if "food_macros" in _tables(conn):
+                for fdc_id, *amounts in conn.execute(_BULK_MACROS_SQL, {"fdc_ids": list(fdc_ids)}):
+                    # A NULL column is a nutrient the food has no value for: leave its key out
+                    out[fdc_id] = {
+                        key: float(amount) for key, amount in zip(MACRO_COLUMNS, amounts) if amount is not None
+                    }
+                return out
             rows = conn.execute(
-                sql,
-                {
-                    "fdc_id": fdc_id,
-                    "cal": NUTRIENT_IDS["calories_kcal"],
-                    "pro": NUTRIENT_IDS["protein_g"],
-                    "carb": NUTRIENT_IDS["carbs_g"],
-                    "fat": NUTRIENT_IDS["fat_g"],
-                    "fiber": NUTRIENT_IDS["fiber_g"],
-                    "sugar": NUTRIENT_IDS["sugar_g"],
-                },
+                _BULK_NUTRIENTS_SQL,
+                {"fdc_ids": list(fdc_ids), "nutrient_ids": list(NUTRIENT_KEYS)},
             ).fetchall()
-        out: dict = {}
-        for r in rows:
-            nid = r._mapping["nutrient_id"]
-            amt = float(r._mapping["amount"]) if r._mapping["amount"] is not None else None
-            if nid == NUTRIENT_IDS["calories_kcal"]:
-                out["calories"] = amt
-            elif nid == NUTRIENT_IDS["protein_g"]:
-                out["protein_g"] = amt
-            elif nid == NUTRIENT_IDS["carbs_g"]:
-                out["carbs_g"] = amt
-            elif nid == NUTRIENT_IDS["fat_g"]:
-                out["fat_g"] = amt
-            elif nid == NUTRIENT_IDS["fiber_g"]:
-                out["fiber_g"] = amt
-            elif nid == NUTRIENT_IDS["sugar_g"]:
-                out["sugar_g"] = amt
-        return out
     except Exception as e:
-        # If food_nutrient table doesn't exist or other DB error, return empty dict
-        print(f"Warning: Could not get nutrients for fdc_id {fdc_id}: {e}")
-        return {}
+        # Same fallback as get_basic_nutrients (e.g. simplified database without food_nutrient)
+        print(f"Warning: Could not get nutrients for fdc_ids {list(fdc_ids)}: {e}")
+        return {fdc_id: {} for fdc_id in fdc_ids}
+    for fdc_id, nutrient_id, amount in rows:
+        out[fdc_id][NUTRIENT_KEYS[nutrient_id]] = float(amount) if amount is not None else None
+    return out
+
+
+def get_basic_nutrients(bind: Bind, fdc_id: int) -> dict:
+    """Common macros (calories, protein, carbs, fat, fiber, sugar) for one food; {} if unknown."""
+    return get_basic_nutrients_bulk(bind, [fdc_id])[fdc_id]
+
+
+_FOOD_WITH_MACROS_SQL = text(
+    f"""
+    SELECT f.fdc_id,
+           f.description,
+           f.data_type,
+           b.brand_name,
+           b.brand_owner,
+           b.gtin_upc,
+           b.serving_size,
+           b.serving_size_unit,
+           {", ".join(f"m.{column}" for column in MACRO_COLUMNS)}
+    FROM food f
+    LEFT JOIN branded_food b ON b.fdc_id = f.fdc_id
+    LEFT JOIN food_macros m ON m.fdc_id = f.fdc_id
+    WHERE f.fdc_id = :fdc_id
+    LIMIT 1
+    """
+)
+
+
+def get_food_with_nutrients(bind: Bind, fdc_id: int) -> Optional[dict]:
+    """get_food_basic's row plus a "nutrients" key holding get_basic_nutrients' dict.
+
+    One joined query on databases with food_macros; otherwise both lookups share one connection.
+    None if the food doesn't exist.
+    """
+    with _connect(bind) as conn:
+        if "food_macros" not in _tables(conn):
+            food = get_food_basic(conn, fdc_id)
+            if food is not None:
+                food["nutrients"] = get_basic_nutrients(conn, fdc_id)
+            return food
+        row = conn.execute(_FOOD_WITH_MACROS_SQL, {"fdc_id": fdc_id}).mappings().first()
+    if row is None:
+        return None
+    food = dict(row)
+    food["nutrients"] = {
+        column: float(amount) for column in MACRO_COLUMNS if (amount := food.pop(column)) is not None
+    }
+    return food
+
+
+# Per-fdc_id cache over the app's read-only USDA engine. The USDA DB only changes when it is
+# rebuilt, so repeated lookups of the same item (e.g. favoriting it twice) skip the round trip.
+@lru_cache(maxsize=4096)
+def get_food_with_nutrients_cached(fdc_id: int) -> Optional[dict]:
+    return get_food_with_nutrients(usda_db.get_usda_engine(), fdc_id)
+
+
+# Search terms and barcode scans repeat across users ("chicken breast", the same milk carton),
+# so repeats skip the search query entirely. The returned tuple and its row dicts are shared by
+# every caller that hits the same entry: treat them as read-only. Callers bound `limit` (it's
+# part of the cache key).
+def search_usda_cached(q: str, limit: int = 20) -> tuple:
+    # Both LIKE and the trigram index are case-insensitive, so case variants share one entry
+    return _search_usda_cached(q.lower(), limit)
+
+
+@lru_cache(maxsize=4096)
+def _search_usda_cached(q: str, limit: int) -> tuple:
+    return tuple(search_usda(usda_db.get_usda_engine(), q, limit))
+
+
+@lru_cache(maxsize=4096)
+def lookup_upc_cached(upc: str) -> Optional[dict]:
+    return lookup_upc(usda_db.get_usda_engine(), upc)
+
+
+def cache_clear() -> None:
+    """Drop cached USDA lookups; call after the USDA database is rebuilt or re-imported."""
+    get_food_with_nutrients_cached.cache_clear()
+    _search_usda_cached.cache_clear()
+    lookup_upc_cached.cache_clear()
+    _tables_by_url.clear()
@@ -20,8 +20,16 @@ if __name__ != '__main__':
     # Production gunicorn setup
     import logging
     gunicorn_logger = logging.getLogger('gunicorn.error')
-    app.logger.handlers = gunicorn_logger.handlers
+    # Root gets gunicorn's stderr handlers; app.logger and the module loggers
+    # (logging.getLogger(__name__)) propagate to it, so each record is emitted once.
+    # Root stays at WARNING so third-party INFO logs (e.g. httpx per OpenAI request) stay quiet;
+    # our own loggers follow gunicorn's level.
+    root_logger = logging.getLogger()
+    root_logger.handlers = gunicorn_logger.handlers
+    root_logger.setLevel(logging.WARNING)
     app.logger.setLevel(gunicorn_logger.level)
+    for name in ('favorites_endpoints', 'mosaic_nutrition_ai', 'usda_db'):
+        logging.getLogger(name).setLevel(gunicorn_logger.level)
 
 # The WSGI callable
 application = app